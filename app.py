@@ -1,8 +1,9 @@
+import os
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
 from fetch_dashboard_data import DashboardData
+from downsampling import downsample, downsample_stacked, line_trace, point_budget
 import pandas as pd
 
 # Set page config
@@ -15,7 +16,8 @@ st.set_page_config(
 # Initialize data fetcher
 @st.cache_resource(ttl=3600)
 def get_dashboard_data():
-    return DashboardData()
+    # Serve an exported Parquet snapshot instead of the databases when one is configured
+    return DashboardData(parquet_dir=os.environ.get('DASHBOARD_PARQUET_DIR'))
 
 # Get data connection
 data = get_dashboard_data()
@@ -26,6 +28,10 @@ page = st.sidebar.selectbox(
     ["Representative Analysis", "Stock Analysis"]
 )
 
+# Result cache counters, for checking that reruns are served from memory
+with st.sidebar.expander("Cache statistics"):
+    st.json(data.cache_stats())
+
 # Define color mapping for parties
 party_colors = {
     'Republican': '#FF0000',  # Red
@@ -44,7 +50,9 @@ if page == "Representative Analysis":
     )
     
     # Date Range Filter
-    portfolio_data = data.get_portfolio_value_analysis(selected_rep)
+    portfolio_data = data.get_portfolio_value_analysis(
+        selected_rep, columns=['transaction_date', 'ticker', 'stock_value']
+    )
     if not portfolio_data.empty:
         min_date = pd.to_datetime(portfolio_data['transaction_date'].min())
         max_date = pd.to_datetime(portfolio_data['transaction_date'].max())
@@ -58,7 +66,9 @@ if page == "Representative Analysis":
         # Filter data based on selected date range
         mask = (portfolio_data['transaction_date'] >= pd.Timestamp(start_date)) & \
                (portfolio_data['transaction_date'] <= pd.Timestamp(end_date))
-        filtered_portfolio_data = portfolio_data[mask]
+        filtered_portfolio_data = downsample_stacked(
+            portfolio_data[mask], 'transaction_date', 'stock_value', point_budget()
+        )
         
         # Portfolio Value Analysis
         st.subheader("Portfolio Value Progression")
@@ -112,7 +122,9 @@ if page == "Representative Analysis":
     with col2:
         # Current Positions
         st.subheader("Current Positions")
-        positions_data = data.get_current_positions(selected_rep)
+        positions_data = data.get_current_positions(
+            selected_rep, columns=['ticker', 'current_value', 'sector']
+        )
         
         if not positions_data.empty:
             fig_positions = px.bar(
@@ -144,7 +156,9 @@ if page == "Representative Analysis":
     with col3:
         # Sector Analysis
         st.subheader("Sector Analysis")
-        sector_data = data.get_representative_sector_analysis(selected_rep)
+        sector_data = data.get_representative_sector_analysis(
+            selected_rep, columns=['sector', 'transaction_count']
+        )
         if not sector_data.empty:
             fig_sector = px.pie(
                 sector_data,
@@ -160,11 +174,9 @@ if page == "Representative Analysis":
     with col4:
         # Trading Activity Timeline
         st.subheader("Trading Activity Timeline")
-        timeline_data = data.get_trading_timeline()
-        rep_timeline = timeline_data[timeline_data['representative'] == selected_rep]
+        daily_trades = data.get_daily_trade_counts(representative_name=selected_rep)
         
-        if not rep_timeline.empty:
-            daily_trades = rep_timeline.groupby('transaction_date').size().reset_index(name='trades')
+        if not daily_trades.empty:
             fig_timeline = px.line(
                 daily_trades,
                 x='transaction_date',
@@ -193,42 +205,50 @@ elif page == "Stock Analysis":
         )
         
         # Date Range Filter
-        stock_price_data = data.get_stock_prices(selected_stock)
-        if stock_price_data.empty:
+        # The pickers' values from the previous run select the slice, so bounds and
+        # prices come back from a single query
+        start_key, end_key = f"stock_start_{selected_stock}", f"stock_end_{selected_stock}"
+        min_date, max_date, filtered_price_data = data.get_stock_price_range(
+            selected_stock,
+            st.session_state.get(start_key),
+            st.session_state.get(end_key)
+        )
+        if min_date is None:
             st.warning(f"No price data available for {selected_stock}")
         else:
-            min_date = pd.to_datetime(stock_price_data['date'].min())
-            max_date = pd.to_datetime(stock_price_data['date'].max())
+            min_date = pd.to_datetime(min_date)
+            max_date = pd.to_datetime(max_date)
             
             col1, col2 = st.columns(2)
             with col1:
-                start_date = st.date_input("Start Date", min_date, min_value=min_date, max_value=max_date)
+                start_date = st.date_input("Start Date", min_date, min_value=min_date, max_value=max_date,
+                                           key=start_key)
             with col2:
-                end_date = st.date_input("End Date", max_date, min_value=min_date, max_value=max_date)
-            
-            # Filter data based on selected date range
-            mask = (stock_price_data['date'] >= pd.Timestamp(start_date)) & \
-                   (stock_price_data['date'] <= pd.Timestamp(end_date))
-            filtered_price_data = stock_price_data[mask]
+                end_date = st.date_input("End Date", max_date, min_value=min_date, max_value=max_date,
+                                         key=end_key)
             
             # Price Chart with Trade Points
             st.subheader("Stock Price and Trading Activity")
             
-            # Get price data and trades data
-            price_data = data.get_stock_prices(selected_stock)
-            trades_data = data.get_stock_trading_timeline(selected_stock)
+            # Get trades data
+            trades_data = data.get_stock_trading_timeline(
+                selected_stock, start_date, end_date,
+                columns=['transaction_date', 'type', 'price_at_trade', 'representative', 'amount']
+            )
             
-            if not price_data.empty:
-                # Filter price data based on selected date range
-                mask = (price_data['date'] >= pd.Timestamp(start_date)) & \
-                       (price_data['date'] <= pd.Timestamp(end_date))
-                filtered_price_data = price_data[mask]
+            if not filtered_price_data.empty:
+                # Thin long ranges to the chart's resolution, keeping a vertex at every trade
+                filtered_price_data = downsample(
+                    filtered_price_data, 'date', 'close', point_budget(),
+                    keep=trades_data['transaction_date'] if not trades_data.empty else None
+                )
                 
                 # Create the figure
                 fig_price = go.Figure()
                 
                 # Add price line
-                fig_price.add_trace(go.Scatter(
+                fig_price.add_trace(line_trace(
+                    len(filtered_price_data),
                     x=filtered_price_data['date'],
                     y=filtered_price_data['close'],
                     name='Stock Price',
@@ -241,13 +261,8 @@ elif page == "Stock Analysis":
                 
                 # Add trade bubbles if available
                 if not trades_data.empty:
-                    trades_in_range = trades_data[
-                        (trades_data['transaction_date'] >= pd.Timestamp(start_date)) & 
-                        (trades_data['transaction_date'] <= pd.Timestamp(end_date))
-                    ]
-                    
                     # Add purchase trades
-                    purchases = trades_in_range[trades_in_range['type'] == 'purchase']
+                    purchases = trades_data[trades_data['type'] == 'purchase']
                     if not purchases.empty:
                         fig_price.add_trace(go.Scatter(
                             x=purchases['transaction_date'],
@@ -270,7 +285,7 @@ elif page == "Stock Analysis":
                         ))
                     
                     # Add sale trades
-                    sales = trades_in_range[trades_in_range['type'] == 'sale']
+                    sales = trades_data[trades_data['type'].str.startswith('sale')]
                     if not sales.empty:
                         fig_price.add_trace(go.Scatter(
                             x=sales['transaction_date'],
@@ -406,8 +421,8 @@ elif page == "Stock Analysis":
             with col4:
                 # Trading Activity Timeline
                 st.subheader("Trading Activity Timeline")
-                if not trades_data.empty:
-                    daily_trades = trades_data.groupby('transaction_date').size().reset_index(name='trades')
+                daily_trades = data.get_daily_trade_counts(ticker=selected_stock)
+                if not daily_trades.empty:
                     fig_timeline = px.line(
                         daily_trades,
                         x='transaction_date',
@@ -423,7 +438,3 @@ elif page == "Stock Analysis":
                     st.plotly_chart(fig_timeline, use_container_width=True)
                 else:
                     st.warning("No trading activity data available")
-
-# Clean up
-if hasattr(data, 'close'):
-    data.close()
\ No newline at end of file
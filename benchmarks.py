@@ -0,0 +1,189 @@
+import time
+import duckdb
+import argparse
+import pandas as pd
+from setup_database_schema import (
+    ESTIMATED_VALUE_SQL, LOADERS, create_transactions_schema, load_transactions_frame,
+    normalize_transactions
+)
+
+def _best_of(fn, repeat=3):
+    """Run fn repeat times and return (best seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def legacy_normalize_transactions(df):
+    """Per-row normalization used by import_initial_data before it was vectorized"""
+    def convert_date(date_str):
+        try:
+            for fmt in ['%m/%d/%Y', '%Y-%m-%d', '%m-%d-%Y']:
+                try:
+                    return pd.to_datetime(date_str, format=fmt).strftime('%Y-%m-%d')
+                except:
+                    continue
+            return None
+        except:
+            return None
+
+    for col in ['disclosure_date', 'transaction_date']:
+        df[col] = df[col].apply(convert_date)
+        df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y-%m-%d')
+    df['disclosure_year'] = pd.to_numeric(df['disclosure_year'], errors='coerce').fillna(0).astype(int)
+    df['cap_gains_over_200_usd'] = df['cap_gains_over_200_usd'].fillna(False)
+    return df
+
+def benchmark_normalization(path=None, repeat=3):
+    """Compare the per-row and vectorized normalization of the staged feed"""
+    raw = load_transactions_frame(path)
+    print(f"Normalizing {len(raw)} rows (best of {repeat})...")
+
+    legacy_time, legacy = _best_of(lambda: legacy_normalize_transactions(raw.copy()), repeat)
+    vector_time, (vectorized, _) = _best_of(lambda: normalize_transactions(raw.copy()), repeat)
+
+    for col in ['disclosure_date', 'transaction_date']:
+        mismatches = (legacy[col].fillna('') != vectorized[col].dt.strftime('%Y-%m-%d').fillna('')).sum()
+        print(f"  {col}: {mismatches} rows differ")
+
+    print(f"  per-row:    {legacy_time:.3f}s")
+    print(f"  vectorized: {vector_time:.3f}s")
+    print(f"  speedup:    {legacy_time / vector_time:.1f}x")
+
+def benchmark_loaders(repeat=1):
+    """Stage the feed with the pandas and DuckDB-native loaders and compare the results"""
+    con = duckdb.connect()
+    create_transactions_schema(con)
+    timings = {}
+    for name, (find_source, stage) in LOADERS.items():
+        source = find_source()
+        timings[name], _ = _best_of(lambda: stage(con, source), repeat)
+        con.execute(f"CREATE OR REPLACE TABLE staged_{name} AS SELECT * FROM staged_transactions")
+
+    only_pandas, only_duckdb = con.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM (SELECT * FROM staged_pandas EXCEPT ALL SELECT * FROM staged_duckdb)),
+            (SELECT COUNT(*) FROM (SELECT * FROM staged_duckdb EXCEPT ALL SELECT * FROM staged_pandas))
+    """).fetchone()
+    rows = con.execute("SELECT COUNT(*) FROM staged_pandas").fetchone()[0]
+    con.close()
+
+    print(f"\nStaged {rows} rows")
+    print(f"  rows only in pandas result: {only_pandas}")
+    print(f"  rows only in duckdb result: {only_duckdb}")
+    for name, elapsed in timings.items():
+        print(f"  {name}: {elapsed:.3f}s")
+
+# Largest dashboard relations, read whole as the unfiltered getters do
+DASHBOARD_RELATIONS = ['trading_timeline', 'stock_trading_timeline', 'portfolio_value_analysis',
+                       'current_positions']
+
+def benchmark_result_modes(repeat=3):
+    """Compare fetchdf and the Arrow-backed result path on the largest dashboard relations"""
+    from fetch_dashboard_data import DashboardData
+    # One instance: connections to the same file share the ATTACHes of the process
+    data = DashboardData()
+    for relation in DASHBOARD_RELATIONS:
+        query = f"SELECT * FROM {relation}"
+        print(f"\n{relation}")
+        for name, arrow in [('fetchdf', False), ('arrow', True)]:
+            data.arrow = arrow
+            # _execute bypasses the result cache, so every run pays for the conversion
+            elapsed, result = _best_of(lambda: data._execute(query), repeat)
+            size = result.memory_usage(index=True, deep=True).sum() / 1024 / 1024
+            print(f"  {name:8} {len(result):>9} rows  {elapsed:.3f}s  {size:.1f} MB")
+    data.close()
+
+# Dashboard relations as they were written before the dimension keys: every join
+# and GROUP BY on representative names and ticker symbols
+LEGACY_DASHBOARD_QUERIES = {
+    'rep_overview': """
+        SELECT
+            t.representative,
+            COUNT(*) as total_trades,
+            COUNT(DISTINCT t.ticker) as unique_stocks,
+            CAST(DATEDIFF('YEAR', MIN(t.transaction_date), MAX(t.transaction_date)) AS INTEGER) + 1 as years_active,
+            SUM(CASE WHEN t.type = 'purchase' THEN 1 ELSE 0 END) as total_purchases,
+            SUM(CASE WHEN t.type = 'sale' THEN 1 ELSE 0 END) as total_sales,
+            COUNT(DISTINCT sd.industry) as unique_sectors,
+            MAX(t.party) as party
+        FROM transactions t
+        LEFT JOIN details.stocks sd ON t.ticker = sd.ticker
+        GROUP BY t.representative
+    """,
+    'representative_sector_analysis': """
+        SELECT
+            t.representative,
+            COALESCE(sd.sector, 'Unknown') as sector,
+            COUNT(*) as transaction_count
+        FROM transactions t
+        LEFT JOIN details.stocks sd ON t.ticker = sd.ticker
+        GROUP BY t.representative, sd.sector
+        HAVING transaction_count > 0
+    """,
+    'current_positions': f"""
+        SELECT
+            t.representative,
+            t.ticker,
+            COALESCE(sd.sector, 'Unknown') as sector,
+            SUM(CASE WHEN t.type = 'purchase' THEN {ESTIMATED_VALUE_SQL}
+                     WHEN t.type = 'sale' THEN -{ESTIMATED_VALUE_SQL}
+                ELSE 0 END) as current_value
+        FROM transactions t
+        LEFT JOIN details.stocks sd ON t.ticker = sd.ticker
+        GROUP BY t.representative, t.ticker, sd.sector
+        HAVING current_value > 0
+    """,
+    'trading_timeline': """
+        SELECT
+            t.ticker,
+            t.transaction_date,
+            t.type,
+            t.representative,
+            t.party,
+            t.amount,
+            p.close as price_at_trade,
+            sd.sector
+        FROM transactions t
+        ASOF LEFT JOIN prices.daily_prices p ON t.ticker = p.ticker AND t.transaction_date >= p.date
+        LEFT JOIN details.stocks sd ON t.ticker = sd.ticker
+    """,
+}
+
+def benchmark_dimension_keys(repeat=3):
+    """Time the dashboard relations keyed by names against the integer-keyed versions"""
+    from create_views import DASHBOARD_RELATIONS
+    con = duckdb.connect('databases/transactions.duckdb', read_only=True)
+    con.execute("ATTACH 'databases/stock_prices.duckdb' AS prices (READ_ONLY)")
+    con.execute("ATTACH 'databases/stock_details.duckdb' AS details (READ_ONLY)")
+    for name, _, query, _ in DASHBOARD_RELATIONS:
+        legacy_time, _ = _best_of(
+            lambda: con.execute(f"CREATE OR REPLACE TEMP TABLE legacy AS {LEGACY_DASHBOARD_QUERIES[name]}"), repeat)
+        keyed_time, _ = _best_of(
+            lambda: con.execute(f"CREATE OR REPLACE TEMP TABLE keyed AS {query}"), repeat)
+        differ = con.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM (SELECT * FROM legacy EXCEPT ALL SELECT * FROM keyed)) +
+                (SELECT COUNT(*) FROM (SELECT * FROM keyed EXCEPT ALL SELECT * FROM legacy))
+        """).fetchone()[0]
+        print(f"\n{name}: {differ} rows differ")
+        print(f"  names:        {legacy_time:.3f}s")
+        print(f"  integer keys: {keyed_time:.3f}s")
+    con.close()
+
+BENCHMARKS = {
+    'normalize': benchmark_normalization,
+    'loaders': benchmark_loaders,
+    'results': benchmark_result_modes,
+    'keys': benchmark_dimension_keys,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run pipeline benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark]()
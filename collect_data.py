@@ -1,20 +1,97 @@
 import requests
 import json
+import os
+import codecs
+import argparse
 import pandas as pd
 from pathlib import Path
+from fetch_engine import shared_engine
 
-def fetch_transaction_data():
+URL = "https://house-stock-watcher-data.s3-us-west-2.amazonaws.com/data/all_transactions.json"
+
+# Columns of the feed, in the order the transactions table expects them
+TRANSACTION_COLUMNS = [
+    'disclosure_year', 'disclosure_date', 'transaction_date', 'owner', 'ticker',
+    'asset_description', 'type', 'amount', 'representative', 'district', 'state',
+    'ptr_link', 'cap_gains_over_200_usd', 'industry', 'sector', 'party'
+]
+
+CRITICAL_FIELDS = ['transaction_date', 'representative', 'ticker', 'amount', 'transaction_type']
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 5000
+
+FEED_STATE_PATH = "data/feed_state.json"
+
+def load_feed_state(output):
+    """Validators (ETag/Last-Modified) remembered from the last download into `output`.
+
+    The CSV and streamed Parquet copies are fetched separately, so each keeps
+    its own validators; a 304 only ever vouches for the copy it was asked about.
+    """
+    try:
+        with open(FEED_STATE_PATH) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    entry = state.get(output)
+    return entry if isinstance(entry, dict) else {}
+
+def save_feed_state(response, records, output):
+    """Remember the validators of a completed download into `output`"""
+    try:
+        with open(FEED_STATE_PATH) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    # Files written before validators were kept per output hold them at the top level
+    state = {key: value for key, value in state.items() if isinstance(value, dict)}
+    state[output] = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'records': records
+    }
+    with open(FEED_STATE_PATH, "w") as f:
+        json.dump(state, f, indent=4)
+
+def conditional_headers(output, raw_output, force=False):
+    """Request headers that let S3 answer 304 when our copy in `output` is current"""
+    if force or not all(Path(p).exists() for p in [raw_output, output]):
+        return {}
+    state = load_feed_state(output)
+    headers = {}
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+    return headers
+
+def fetch_transaction_data(stream=False, force=False):
     """Fetch transaction data from the House Stock Watcher API"""
-    url = "https://house-stock-watcher-data.s3-us-west-2.amazonaws.com/data/all_transactions.json"
+    if stream:
+        return stream_transaction_data(force=force)
+
+    url = URL
     
     try:
-        # Fetch data from URL
+        # Fetch data from URL, unless it hasn't changed since the last download
         print("Fetching data from API...")
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        
-        # Parse JSON data
-        data = response.json()
+        headers = conditional_headers("data/all_transactions.csv", "data/all_transactions.json", force)
+        engine = shared_engine()
+        try:
+            # Only the request runs under the engine's timeout; the body then downloads here,
+            # bounded by the socket read timeout, so a slow but steady feed is not cut off
+            response = engine.get(url, headers=headers, stream=True)
+            if response.status_code == 304:
+                response.close()
+                print("Feed not modified since last download, using data/all_transactions.csv")
+                return pd.read_csv("data/all_transactions.csv")
+            response.raise_for_status()  # Raise an exception for bad status codes
+            
+            # Parse JSON data
+            data = response.json()
+        finally:
+            engine.close()
         
         # Create data directory if it doesn't exist
         Path("data").mkdir(exist_ok=True)
@@ -28,7 +105,7 @@ def fetch_transaction_data():
         df = pd.DataFrame(data)
         
         # Validate critical fields
-        critical_fields = ['transaction_date', 'representative', 'ticker', 'amount', 'transaction_type']
+        critical_fields = CRITICAL_FIELDS
         missing_fields = [field for field in critical_fields if field not in df.columns]
         
         if missing_fields:
@@ -44,13 +121,177 @@ def fetch_transaction_data():
 
         print("Saving data as CSV...")
         df.to_csv("data/all_transactions.csv", index=False)
+        save_feed_state(response, len(df), "data/all_transactions.csv")
         
         print(f"Successfully downloaded {len(df)} transactions")
         return df
         
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, TimeoutError) as e:
+        print(f"Error fetching data: {e}")
+        return None
+
+def iter_json_array(chunks):
+    """Incrementally parse a top-level JSON array, yielding one element at a time.
+
+    Elements of any type are supported; each is yielded once the `,` or `]`
+    following it has been read.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    started = False
+    exhausted = False
+
+    def more():
+        nonlocal buffer, pos, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer = buffer[pos:] + utf8.decode(b'', final=True)
+            exhausted = True
+        else:
+            buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+
+    while True:
+        # Skip whitespace and separators between elements
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(buffer):
+            if exhausted:
+                raise ValueError("Unexpected end of JSON array")
+            more()
+            continue
+
+        if not started:
+            if buffer[pos] != '[':
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Element is split across chunks; read more and retry
+            if exhausted:
+                raise
+            more()
+            continue
+
+        # A number cut off at a chunk boundary still decodes ('[12' of '[1234'),
+        # so an element is only taken once the delimiter after it has arrived
+        after = end
+        while after < len(buffer) and buffer[after] in ' \t\r\n':
+            after += 1
+        if after >= len(buffer) and not exhausted:
+            more()
+            continue
+
+        pos = end
+        yield item
+
+def _batch_to_columns(records, missing_counts, seen_fields):
+    """Validate a batch of records and pivot it into column lists"""
+    for record in records:
+        seen_fields.update(record.keys())
+        for field in CRITICAL_FIELDS:
+            if record.get(field) is None:
+                missing_counts[field] += 1
+
+    columns = {}
+    for col in TRANSACTION_COLUMNS:
+        values = [record.get(col) for record in records]
+        if col == 'cap_gains_over_200_usd':
+            columns[col] = [v if isinstance(v, bool) else None for v in values]
+        else:
+            columns[col] = [None if v is None else str(v) for v in values]
+    return columns
+
+def stream_transaction_data(url=URL, output="data/all_transactions.parquet",
+                            raw_output="data/all_transactions.json", batch_size=BATCH_SIZE,
+                            force=False):
+    """Stream the feed into a Parquet staging file in bounded memory"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        (col, pa.bool_() if col == 'cap_gains_over_200_usd' else pa.string())
+        for col in TRANSACTION_COLUMNS
+    ])
+
+    try:
+        print("Streaming data from API...")
+        Path("data").mkdir(exist_ok=True)
+
+        missing_counts = {field: 0 for field in CRITICAL_FIELDS}
+        seen_fields = set()
+        total = 0
+
+        headers = conditional_headers(output, raw_output, force)
+        engine = shared_engine()
+        try:
+            with engine.get(url, headers=headers, stream=True) as response:
+                if response.status_code == 304:
+                    records = load_feed_state(output).get('records') or 0
+                    print(f"Feed not modified since last download, keeping {output}")
+                    return records
+                response.raise_for_status()
+
+                # Write to temporary files so an interrupted download never looks current
+                with open(raw_output + ".part", "wb") as raw_file, \
+                        pq.ParquetWriter(output + ".part", schema, compression='zstd') as writer:
+
+                    def chunks():
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            # Keep the raw payload byte-for-byte instead of re-serializing it
+                            raw_file.write(chunk)
+                            yield chunk
+
+                    batch = []
+                    for record in iter_json_array(chunks()):
+                        batch.append(record)
+                        if len(batch) >= batch_size:
+                            columns = _batch_to_columns(batch, missing_counts, seen_fields)
+                            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                            total += len(batch)
+                            batch = []
+
+                    if batch:
+                        columns = _batch_to_columns(batch, missing_counts, seen_fields)
+                        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                        total += len(batch)
+        finally:
+            engine.close()
+
+        # Same warnings as the in-memory path, accumulated across batches
+        missing_fields = [field for field in CRITICAL_FIELDS if field not in seen_fields]
+        if missing_fields:
+            print(f"Warning: Missing critical fields: {missing_fields}")
+
+        for field in CRITICAL_FIELDS:
+            if field in seen_fields and missing_counts[field] > 0:
+                print(f"Warning: {missing_counts[field]} missing values in {field}")
+
+        os.replace(raw_output + ".part", raw_output)
+        os.replace(output + ".part", output)
+        save_feed_state(response, total, output)
+        print(f"Successfully streamed {total} transactions to {output}")
+        return total
+
+    except (requests.exceptions.RequestException, TimeoutError, ValueError) as e:
         print(f"Error fetching data: {e}")
         return None
 
 if __name__ == "__main__":
-    fetch_transaction_data() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Collect transaction data")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the feed into data/all_transactions.parquet in bounded memory")
+    parser.add_argument("--force", action="store_true",
+                        help="Download even if the feed has not changed")
+    args = parser.parse_args()
+    fetch_transaction_data(stream=args.stream, force=args.force)
@@ -0,0 +1,118 @@
+import re
+import time
+import duckdb
+import argparse
+
+# Tables rewritten in the order their lookups filter on: (database, table, sort columns).
+# DuckDB keeps min/max statistics per row group, so once rows are clustered by the
+# first column a lookup on it skips every row group but the few holding that key.
+COMPACT_TABLES = [
+    ('databases/stock_prices.duckdb', 'daily_prices', ['ticker', 'date']),
+    ('databases/transactions.duckdb', 'transactions', ['representative', 'transaction_date']),
+]
+
+# String statistics only keep a prefix of this many bytes
+STATS_PREFIX_BYTES = 8
+
+STATS_PATTERN = re.compile(r'^\[Min: (.*?), Max: (.*?)(?:, Has Unicode|\])')
+
+def _zone_maps(con, table, column):
+    """(row group, min, max) of a column's segments, as the stored prefixes"""
+    zones = []
+    for row_group, stats in con.execute(f"""
+        SELECT row_group_id, stats FROM pragma_storage_info('{table}')
+        WHERE column_name = ? AND segment_type != 'VALIDITY'
+    """, [column]).fetchall():
+        match = STATS_PATTERN.match(stats or '')
+        if match:
+            zones.append((row_group, match.group(1).encode(), match.group(2).encode()))
+    return zones
+
+def pruning_stats(con, table, column):
+    """Row groups of a table and how many of them an equality lookup on `column` must read"""
+    zones = _zone_maps(con, table, column)
+    row_groups = len(set(zone[0] for zone in zones))
+    keys = [row[0] for row in con.execute(f"""
+        SELECT DISTINCT CAST({column} AS VARCHAR) FROM {table} WHERE {column} IS NOT NULL
+    """).fetchall()]
+    scanned = []
+    for key in keys:
+        prefix = key.encode()[:STATS_PREFIX_BYTES]
+        scanned.append(len(set(
+            row_group for row_group, low, high in zones
+            if low[:STATS_PREFIX_BYTES] <= prefix <= high[:STATS_PREFIX_BYTES]
+        )))
+    return {
+        'rows': con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0],
+        'row_groups': row_groups,
+        'keys': len(keys),
+        'avg_row_groups_per_lookup': sum(scanned) / len(scanned) if scanned else 0.0,
+        'max_row_groups_per_lookup': max(scanned) if scanned else 0,
+    }
+
+def print_pruning_stats(label, stats):
+    print(f"  {label}: {stats['rows']} rows in {stats['row_groups']} row groups; a lookup on one of "
+          f"{stats['keys']} keys reads {stats['avg_row_groups_per_lookup']:.1f} row groups on average, "
+          f"{stats['max_row_groups_per_lookup']} at most")
+
+def rewrite_sorted(con, table, order):
+    """Rewrite a table in `order`, keeping its definition, constraints and indexes"""
+    ddl = con.execute("""
+        SELECT sql FROM duckdb_tables()
+        WHERE database_name = current_database() AND schema_name = 'main' AND table_name = ?
+    """, [table]).fetchone()[0]
+    indexes = [sql for (sql,) in con.execute("""
+        SELECT sql FROM duckdb_indexes()
+        WHERE database_name = current_database() AND table_name = ?
+    """, [table]).fetchall() if sql]
+    staging = f"{table}_sorted"
+    staging_ddl, replaced = re.subn(rf'^CREATE TABLE\s+"?{table}"?\s*\(', f"CREATE TABLE {staging}(", ddl)
+    if not replaced:
+        raise ValueError(f"Unexpected definition of {table}: {ddl}")
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DROP TABLE IF EXISTS {staging}")
+        con.execute(staging_ddl)
+        con.execute(f"INSERT INTO {staging} SELECT * FROM {table} ORDER BY {', '.join(order)}")
+        con.execute(f"DROP TABLE {table}")
+        con.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+        for sql in indexes:
+            con.execute(sql)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    # Write the new row groups out and release the old ones
+    con.execute("CHECKPOINT")
+
+def compact_storage(tables=None, stats_only=False):
+    """Cluster the lookup tables by their filter columns and report row-group pruning"""
+    try:
+        for database, table, order in COMPACT_TABLES:
+            if tables and table not in tables:
+                continue
+            print(f"\n{table} ({database}), clustered by {', '.join(order)}:")
+            con = duckdb.connect(database, read_only=stats_only)
+            print_pruning_stats("before" if not stats_only else "now", pruning_stats(con, table, order[0]))
+            if not stats_only:
+                started = time.perf_counter()
+                rewrite_sorted(con, table, order)
+                print(f"  rewritten in {time.perf_counter() - started:.2f}s")
+                print_pruning_stats("after", pruning_stats(con, table, order[0]))
+            con.close()
+        return True
+    except Exception as e:
+        print(f"Error compacting storage: {e}")
+        if 'con' in locals():
+            con.close()
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rewrite daily_prices and transactions sorted by their lookup columns")
+    parser.add_argument("--table", action="append", choices=[table for _, table, _ in COMPACT_TABLES],
+                        default=None, help="Only compact this table (repeatable)")
+    parser.add_argument("--stats-only", action="store_true",
+                        help="Only report row-group pruning, without rewriting")
+    args = parser.parse_args()
+    compact_storage(tables=args.table, stats_only=args.stats_only)
@@ -1,108 +1,248 @@
 import duckdb
+import argparse
 import pandas as pd
+from datetime import datetime
+from pipeline_state import bump_data_version, get_state, set_state, changes_since, trim_change_log
+from setup_database_schema import ESTIMATED_VALUE_SQL
+from portfolio_valuation import PORTFOLIO_TABLE, build_portfolio_values
+from trade_prices import TRADE_PRICES_TABLE, build_trade_prices
 
-def create_dashboard_views():
-    try:
-        con = duckdb.connect('databases/transactions.duckdb')
-        con.execute("ATTACH 'databases/stock_prices.duckdb' AS prices (READ_ONLY)")
-        con.execute("ATTACH 'databases/stock_details.duckdb' AS details (READ_ONLY)")
-
-        # Representative Overview View
-        print("Creating representative overview view...")
-        con.execute("""
-            DROP VIEW IF EXISTS rep_overview;
-            CREATE VIEW rep_overview AS
-            SELECT 
-                t.representative,
+# Dashboard relations: (name, partition column, query, order). The partition column
+# is what the dashboard filters on and what incremental refreshes replace. Joins and
+# aggregations run on the integer keys of the dimensions; names are joined back last.
+DASHBOARD_RELATIONS = [
+    ('rep_overview', 'representative', """
+        WITH per_rep AS (
+            SELECT
+                t.representative_id,
                 COUNT(*) as total_trades,
-                COUNT(DISTINCT t.ticker) as unique_stocks,
+                COUNT(DISTINCT t.ticker_id) as unique_stocks,
                 CAST(DATEDIFF('YEAR', MIN(t.transaction_date), MAX(t.transaction_date)) AS INTEGER) + 1 as years_active,
                 SUM(CASE WHEN t.type = 'purchase' THEN 1 ELSE 0 END) as total_purchases,
                 SUM(CASE WHEN t.type = 'sale' THEN 1 ELSE 0 END) as total_sales,
                 COUNT(DISTINCT sd.industry) as unique_sectors,
                 MAX(t.party) as party
             FROM transactions t
-            LEFT JOIN details.stocks sd ON t.ticker = sd.ticker
-            GROUP BY t.representative;
-        """)
-
-        # Representative Sector Analysis View
-        print("Creating sector analysis view...")
-        con.execute("""
-            DROP VIEW IF EXISTS representative_sector_analysis;
-            CREATE VIEW representative_sector_analysis AS
-            SELECT 
-                t.representative,
+            LEFT JOIN details.stocks sd ON t.ticker_id = sd.ticker_id
+            GROUP BY t.representative_id
+        )
+        SELECT r.representative, p.* EXCLUDE (representative_id)
+        FROM per_rep p
+        LEFT JOIN representative_dim r ON r.representative_id = p.representative_id
+    """, None),
+    ('representative_sector_analysis', 'representative', """
+        WITH per_sector AS (
+            SELECT
+                t.representative_id,
                 COALESCE(sd.sector, 'Unknown') as sector,
                 COUNT(*) as transaction_count
             FROM transactions t
-            LEFT JOIN details.stocks sd ON t.ticker = sd.ticker
-            GROUP BY t.representative, sd.sector
+            LEFT JOIN details.stocks sd ON t.ticker_id = sd.ticker_id
+            GROUP BY t.representative_id, sd.sector
             HAVING transaction_count > 0
-            ORDER BY transaction_count DESC;
-        """)
-
-        # Current Positions View
-        print("Creating current positions view...")
-        con.execute("""
-            DROP VIEW IF EXISTS current_positions;
-            CREATE VIEW current_positions AS
-            WITH trade_values AS (
-                SELECT 
-                    representative,
-                    ticker,
-                    transaction_date,
-                    type,
-                    CASE 
-                        WHEN amount = '< $1,000' THEN 500
-                        WHEN amount = '$1,001 - $15,000' THEN 8000
-                        WHEN amount = '$15,001 - $50,000' THEN 32500
-                        WHEN amount = '$50,001 - $100,000' THEN 75000
-                        WHEN amount = '$100,001 - $250,000' THEN 175000
-                        WHEN amount = '$250,001 - $500,000' THEN 375000
-                        WHEN amount = '$500,001 - $1,000,000' THEN 750000
-                        WHEN amount = '$1,000,001 - $5,000,000' THEN 3000000
-                        WHEN amount = '> $5,000,000' THEN 5000000
-                        ELSE 0
-                    END as estimated_value
-                FROM transactions
-            )
-            SELECT 
-                t.representative,
-                t.ticker,
+        )
+        SELECT r.representative, s.* EXCLUDE (representative_id)
+        FROM per_sector s
+        LEFT JOIN representative_dim r ON r.representative_id = s.representative_id
+    """, "transaction_count DESC"),
+    ('current_positions', 'representative', f"""
+        WITH positions AS (
+            SELECT
+                t.representative_id,
+                t.ticker_id,
                 COALESCE(sd.sector, 'Unknown') as sector,
-                SUM(CASE WHEN t.type = 'purchase' THEN t.estimated_value
-                         WHEN t.type = 'sale' THEN -t.estimated_value
+                SUM(CASE WHEN t.type = 'purchase' THEN {ESTIMATED_VALUE_SQL}
+                         WHEN t.type = 'sale' THEN -{ESTIMATED_VALUE_SQL}
                     ELSE 0 END) as current_value
-            FROM trade_values t
-            LEFT JOIN details.stocks sd ON t.ticker = sd.ticker
-            GROUP BY t.representative, t.ticker, sd.sector
-            HAVING current_value > 0
-            ORDER BY current_value DESC;
-        """)
-
-        # Trading Timeline View
-        print("Creating trading timeline view...")
-        con.execute("""
-            DROP VIEW IF EXISTS trading_timeline;
-            CREATE VIEW trading_timeline AS
-            SELECT 
-                t.ticker,
-                t.transaction_date,
-                t.type,
-                t.representative,
-                t.party,
-                t.amount,
-                p.close as price_at_trade,
-                sd.sector
             FROM transactions t
-            LEFT JOIN prices.daily_prices p ON t.ticker = p.ticker AND t.transaction_date = p.date
-            LEFT JOIN details.stocks sd ON t.ticker = sd.ticker
-            ORDER BY t.transaction_date;
-        """)
+            LEFT JOIN details.stocks sd ON t.ticker_id = sd.ticker_id
+            GROUP BY t.representative_id, t.ticker_id, sd.sector
+            HAVING current_value > 0
+        )
+        SELECT r.representative, k.ticker, p.sector, p.current_value
+        FROM positions p
+        LEFT JOIN representative_dim r ON r.representative_id = p.representative_id
+        LEFT JOIN ticker_dim k ON k.ticker_id = p.ticker_id
+    """, "current_value DESC"),
+    ('trading_timeline', 'ticker', """
+        SELECT
+            t.ticker,
+            t.transaction_date,
+            t.type,
+            t.representative,
+            t.party,
+            t.amount,
+            p.close as price_at_trade,
+            sd.sector
+        FROM transactions t
+        ASOF LEFT JOIN prices.daily_prices p ON t.ticker_id = p.ticker_id AND t.transaction_date >= p.date
+        LEFT JOIN details.stocks sd ON t.ticker_id = sd.ticker_id
+    """, "transaction_date"),
+]
+
+# Tables computed by their own engines and always stored: (name, partition column, builder).
+# A builder takes the connection and optionally the partition keys to rebuild.
+DERIVED_TABLES = [
+    (PORTFOLIO_TABLE, 'representative', build_portfolio_values),
+    (TRADE_PRICES_TABLE, 'ticker', build_trade_prices),
+]
+
+# Views over the derived tables, recreated on every run
+DERIVED_VIEWS = [
+    ('stock_trading_timeline', f"""
+        SELECT * FROM {TRADE_PRICES_TABLE}
+    """),
+]
+
+def _relation_type(con, name):
+    """'VIEW', 'BASE TABLE' or None for a relation in the main database"""
+    row = con.execute("""
+        SELECT table_type FROM information_schema.tables
+        WHERE table_catalog = current_database() AND table_schema = 'main' AND table_name = ?
+    """, [name]).fetchone()
+    return row[0] if row else None
+
+def _drop_relation(con, name):
+    relation_type = _relation_type(con, name)
+    if relation_type == 'VIEW':
+        con.execute(f"DROP VIEW {name}")
+    elif relation_type == 'BASE TABLE':
+        con.execute(f"DROP TABLE {name}")
+
+# Databases whose change logs the refresh reads
+CHANGE_LOG_DATABASES = [
+    'databases/transactions.duckdb',
+    'databases/stock_prices.duckdb',
+    'databases/stock_details.duckdb',
+]
+
+def trim_change_logs(before):
+    """Drop the change log entries the next refresh will not read, so the logs stay small"""
+    for database in CHANGE_LOG_DATABASES:
+        con = duckdb.connect(database)
+        trim_change_log(con, before)
+        con.close()
+
+def changed_partitions(con, since):
+    """Representatives and tickers whose dashboard rows may have changed since `since`.
+
+    Returns None if any database has no change log, in which case everything
+    must be rebuilt.
+    """
+    trans_reps = changes_since(con, 'representative', since)
+    trans_tickers = changes_since(con, 'ticker', since)
+    price_tickers = changes_since(con, 'ticker', since, table='prices.change_log')
+    detail_tickers = changes_since(con, 'ticker', since, table='details.change_log')
+    if None in (trans_reps, trans_tickers, price_tickers, detail_tickers):
+        return None
+
+    # New details or prices change the rows of everyone who traded the ticker
+    # (sectors in the aggregates, marks in the portfolio valuation)
+    market_tickers = detail_tickers | price_tickers
+    con.register('market_tickers', pd.DataFrame({'ticker': pd.Series(list(market_tickers), dtype=object)}))
+    market_reps = set(row[0] for row in con.execute("""
+        SELECT DISTINCT representative FROM transactions
+        WHERE ticker IN (SELECT ticker FROM market_tickers)
+    """).fetchall())
+    con.unregister('market_tickers')
+
+    return {
+        'representative': trans_reps | market_reps,
+        'ticker': trans_tickers | price_tickers | detail_tickers,
+    }
+
+def materialize_relation(con, name, partition, query, keys=None):
+    """Rebuild a dashboard table, or replace only the partitions listed in keys"""
+    if keys is None:
+        _drop_relation(con, name)
+        # Clustered by the partition column so lookups touch few row groups
+        con.execute(f"CREATE TABLE {name} AS SELECT * FROM ({query}) ORDER BY {partition}")
+        con.execute(f"CREATE INDEX idx_{name}_{partition} ON {name} ({partition})")
+        return None
+
+    con.register('refresh_keys', pd.DataFrame({'key': pd.Series(list(keys), dtype=object)}))
+    in_keys = f"EXISTS (SELECT 1 FROM refresh_keys k WHERE k.key IS NOT DISTINCT FROM {{}}.{partition})"
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM {name} WHERE {in_keys.format(name)}")
+        con.execute(f"INSERT INTO {name} SELECT * FROM ({query}) q WHERE {in_keys.format('q')}")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.unregister('refresh_keys')
+    return len(keys)
+
+def create_derived_views(con):
+    for name, query in DERIVED_VIEWS:
+        _drop_relation(con, name)
+        con.execute(f"CREATE VIEW {name} AS {query}")
+
+def create_dashboard_views(materialize=False, full_refresh=False):
+    """Create the dashboard relations as views, or as incrementally refreshed tables"""
+    try:
+        con = duckdb.connect('databases/transactions.duckdb')
+        con.execute("ATTACH 'databases/stock_prices.duckdb' AS prices (READ_ONLY)")
+        con.execute("ATTACH 'databases/stock_details.duckdb' AS details (READ_ONLY)")
+
+        # Changes logged after this point are picked up by the next refresh
+        refresh_started = datetime.now()
+
+        if not materialize:
+            for name, _, query, order in DASHBOARD_RELATIONS:
+                print(f"Creating {name} view...")
+                _drop_relation(con, name)
+                con.execute(f"CREATE VIEW {name} AS {query}" + (f" ORDER BY {order}" if order else ""))
+            for name, _, build in DERIVED_TABLES:
+                print(f"Building {name}...")
+                build(con)
+            create_derived_views(con)
+            set_state(con, 'dashboard_refreshed_at', None)
+            con.close()
+            # The next materialized refresh rebuilds everything, so no entry is needed
+            trim_change_logs(refresh_started)
+            bump_data_version()
+            print("Successfully created all views!")
+            return True
+
+        last_refresh = get_state(con, 'dashboard_refreshed_at')
+        partitions = None
+        if last_refresh and not full_refresh:
+            partitions = changed_partitions(con, datetime.fromisoformat(last_refresh))
+
+        changed = False
+        for name, partition, query, _ in DASHBOARD_RELATIONS:
+            if partitions is None or _relation_type(con, name) != 'BASE TABLE':
+                print(f"Materializing {name}...")
+                materialize_relation(con, name, partition, query)
+                changed = True
+            elif partitions[partition]:
+                count = materialize_relation(con, name, partition, query, partitions[partition])
+                print(f"Refreshed {count} {partition} partitions of {name}")
+                changed = True
+            else:
+                print(f"{name} is up to date")
+
+        for name, partition, build in DERIVED_TABLES:
+            if partitions is None or _relation_type(con, name) != 'BASE TABLE':
+                print(f"Building {name}...")
+                build(con)
+                changed = True
+            elif partitions[partition]:
+                build(con, partitions[partition])
+                print(f"Rebuilt {len(partitions[partition])} {partition} partitions of {name}")
+                changed = True
+            else:
+                print(f"{name} is up to date")
+        create_derived_views(con)
 
+        set_state(con, 'dashboard_refreshed_at', refresh_started.isoformat())
         con.close()
-        print("Successfully created all views!")
+        trim_change_logs(refresh_started)
+        if changed:
+            bump_data_version()
+        print("Successfully materialized all dashboard tables!")
         return True
 
     except Exception as e:
@@ -112,4 +252,10 @@ def create_dashboard_views():
         return False
 
 if __name__ == "__main__":
-    create_dashboard_views() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create the dashboard views or tables")
+    parser.add_argument("--materialize", action="store_true",
+                        help="Store the dashboard relations as tables, refreshing only changed partitions")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="With --materialize, rebuild every table instead of refreshing changes")
+    args = parser.parse_args()
+    create_dashboard_views(materialize=args.materialize, full_refresh=args.full_refresh)
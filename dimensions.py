@@ -0,0 +1,113 @@
+import time
+import duckdb
+import argparse
+
+# Dimension tables in the transactions database. Surrogate keys are assigned
+# once per name or symbol and never change, so the other databases can store them.
+DIMENSION_TABLES = ['representative_dim', 'ticker_dim']
+
+def ensure_dimensions(con):
+    """Create the representative and ticker dimensions"""
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS representative_dim (
+            representative_id INTEGER PRIMARY KEY,
+            representative VARCHAR UNIQUE,
+            district VARCHAR,
+            state VARCHAR,
+            party VARCHAR
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS ticker_dim (
+            ticker_id INTEGER PRIMARY KEY,
+            ticker VARCHAR UNIQUE
+        )
+    """)
+
+def sync_dimensions(con, source):
+    """Add a key for every representative and ticker in `source` that does not have one yet"""
+    for table, key, column in [('representative_dim', 'representative_id', 'representative'),
+                               ('ticker_dim', 'ticker_id', 'ticker')]:
+        con.execute(f"""
+            INSERT INTO {table} ({key}, {column})
+            SELECT
+                COALESCE((SELECT MAX({key}) FROM {table}), 0) + ROW_NUMBER() OVER (ORDER BY {column}),
+                {column}
+            FROM (SELECT DISTINCT {column} FROM {source} WHERE {column} IS NOT NULL) s
+            WHERE NOT EXISTS (SELECT 1 FROM {table} d WHERE d.{column} = s.{column})
+        """)
+
+def assign_transaction_keys(con):
+    """Set representative_id and ticker_id on transactions rows that lack them"""
+    sync_dimensions(con, 'transactions')
+    con.execute("""
+        UPDATE transactions
+        SET representative_id = d.representative_id
+        FROM representative_dim d
+        WHERE d.representative = transactions.representative
+        AND transactions.representative_id IS NULL
+    """)
+    con.execute("""
+        UPDATE transactions
+        SET ticker_id = d.ticker_id
+        FROM ticker_dim d
+        WHERE d.ticker = transactions.ticker
+        AND transactions.ticker_id IS NULL
+    """)
+
+def refresh_representative_attributes(con):
+    """Set each representative's district, state and party to the ones of their latest filing"""
+    con.execute("""
+        UPDATE representative_dim
+        SET district = latest.district, state = latest.state, party = latest.party
+        FROM (
+            SELECT
+                representative_id,
+                arg_max(district, COALESCE(disclosure_date, DATE '1900-01-01')) as district,
+                arg_max(CAST(state AS VARCHAR), COALESCE(disclosure_date, DATE '1900-01-01')) as state,
+                arg_max(CAST(party AS VARCHAR), COALESCE(disclosure_date, DATE '1900-01-01')) as party
+            FROM transactions
+            GROUP BY representative_id
+        ) latest
+        WHERE latest.representative_id = representative_dim.representative_id
+    """)
+
+def ticker_ids(con):
+    """The ticker -> ticker_id map, to hand to the prices and details databases"""
+    return con.execute("SELECT ticker, ticker_id FROM ticker_dim").fetchdf()
+
+def assign_ticker_ids(con, table, ticker_map):
+    """Set ticker_id on the rows of a prices or details table from a ticker_ids() map"""
+    con.register('ticker_map', ticker_map)
+    con.execute(f"""
+        UPDATE {table}
+        SET ticker_id = m.ticker_id
+        FROM ticker_map m
+        WHERE m.ticker = {table}.ticker
+        AND {table}.ticker_id IS DISTINCT FROM m.ticker_id
+    """)
+    con.unregister('ticker_map')
+
+def propagate_ticker_ids(con_trans):
+    """Copy the ticker keys into daily_prices and stocks"""
+    ticker_map = ticker_ids(con_trans)
+    for database, table in [('databases/stock_prices.duckdb', 'daily_prices'),
+                            ('databases/stock_details.duckdb', 'stocks')]:
+        con = duckdb.connect(database)
+        assign_ticker_ids(con, table, ticker_map)
+        con.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assign surrogate keys and copy ticker keys to the other databases")
+    parser.parse_args()
+
+    started = time.perf_counter()
+    con = duckdb.connect('databases/transactions.duckdb')
+    ensure_dimensions(con)
+    assign_transaction_keys(con)
+    refresh_representative_attributes(con)
+    propagate_ticker_ids(con)
+    counts = [con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in DIMENSION_TABLES]
+    con.close()
+    print(f"{counts[0]} representatives and {counts[1]} tickers keyed in "
+          f"{time.perf_counter() - started:.2f}s")
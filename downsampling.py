@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Width the dashboard charts are laid out for, in pixels
+CHART_WIDTH = 1200
+
+def point_budget(width=CHART_WIDTH, method='lttb'):
+    """Points worth sending for a chart of the given width.
+
+    LTTB needs about one point per pixel; min/max keeps two per bucket.
+    """
+    return width * (2 if method == 'minmax' else 1)
+
+# Above this many points a line is drawn with WebGL instead of SVG. Set above every
+# budget, with room for kept trade dates, so downsampled lines stay SVG and only
+# series drawn at full resolution switch to WebGL.
+WEBGL_THRESHOLD = 2 * point_budget(CHART_WIDTH, 'minmax')
+
+def _numeric(values):
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(float)
+    return values.to_numpy(dtype=float)
+
+def lttb_indices(x, y, n):
+    """Positions of the n points chosen by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. Each bucket in between keeps
+    the point forming the largest triangle with the previously kept point and
+    the average of the next bucket, which preserves peaks and troughs.
+    """
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    selected = np.empty(n, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (size - 1, size)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def minmax_indices(y, n):
+    """Positions of the minimum and maximum of each of n // 2 equal-count buckets"""
+    size = len(y)
+    buckets = n // 2
+    if n >= size or buckets < 1:
+        return np.arange(size)
+    bucket = np.arange(size) * buckets // size
+    values = pd.Series(y).groupby(bucket)
+    return np.unique(np.concatenate([values.idxmin().to_numpy(), values.idxmax().to_numpy(), [0, size - 1]]))
+
+def downsample(df, x, y, max_points, method='lttb', keep=None):
+    """Reduce a series sorted by x to about max_points rows, keeping visual extremes.
+
+    Rows whose x is in `keep` (e.g. trade dates) are always kept, so markers
+    drawn at those x values sit on a vertex of the line.
+    """
+    if max_points is None or len(df) <= max_points:
+        return df
+    frame = df.dropna(subset=[y]).reset_index(drop=True)
+    if method == 'minmax':
+        positions = minmax_indices(frame[y].to_numpy(dtype=float), max_points)
+    else:
+        positions = lttb_indices(_numeric(frame[x]), frame[y].to_numpy(dtype=float), max_points)
+
+    mask = np.zeros(len(frame), dtype=bool)
+    mask[positions] = True
+    if keep is not None:
+        mask |= frame[x].isin(pd.Series(keep)).to_numpy()
+    return frame[mask].reset_index(drop=True)
+
+def downsample_stacked(df, x, y, max_points, method='lttb'):
+    """Downsample a stacked chart to about max_points shared x values.
+
+    The x values are chosen on the stack total, so every series keeps the
+    same dates and the stacking stays aligned.
+    """
+    if max_points is None or df[x].nunique() <= max_points:
+        return df
+    totals = df.groupby(x, as_index=False)[y].sum().sort_values(x)
+    kept = downsample(totals, x, y, max_points, method)[x]
+    return df[df[x].isin(kept)].reset_index(drop=True)
+
+def line_trace(n_points, **kwargs):
+    """A line trace, drawn with WebGL when it has more than WEBGL_THRESHOLD points"""
+    if n_points > WEBGL_THRESHOLD:
+        return go.Scattergl(mode='lines', **kwargs)
+    return go.Scatter(**kwargs)
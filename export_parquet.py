@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import shutil
+import duckdb
+import argparse
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+from compact_storage import COMPACT_TABLES
+from pipeline_state import write_data_version, read_data_version
+
+EXPORT_DIR = 'exports/parquet'
+MANIFEST_NAME = 'manifest.json'
+
+# Databases exported, under the names the dashboard queries them by. The first is
+# the main database; the others are attached, and become schemas in a snapshot.
+EXPORT_DATABASES = [
+    ('transactions', 'databases/transactions.duckdb'),
+    ('prices', 'databases/stock_prices.duckdb'),
+    ('details', 'databases/stock_details.duckdb'),
+    ('reps', 'databases/representatives.duckdb'),
+]
+
+# Pipeline bookkeeping, which stays with the databases
+SKIPPED_TABLES = {'pipeline_state', 'change_log', 'fetch_journal', 'fetch_runs', 'price_coverage',
+                  'answered_gaps', 'ticker_registry'}
+
+PRICE_BUCKETS = 16
+
+# Hive partitioning of the large tables: (database, table) -> [(partition column, expression)].
+# Price buckets use the ticker key, which never changes, so a ticker stays in its bucket.
+PARTITIONS = {
+    ('transactions', 'transactions'): [('disclosure_year', 'disclosure_year')],
+    ('prices', 'daily_prices'): [('ticker_bucket', f'COALESCE(ticker_id, 0) % {PRICE_BUCKETS}'),
+                                 ('year', 'YEAR(date)')],
+}
+
+# Rows are written in the order compact_storage keeps them, so readers skip row groups too
+EXPORT_ORDER = {table: order for _, table, order in COMPACT_TABLES}
+
+# Directory value of a NULL partition. DuckDB releases write either marker.
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+NULL_MARKERS = {NULL_PARTITION, 'NULL'}
+
+def partition_path(columns, values):
+    """Relative directory of a partition, e.g. 'ticker_bucket=3/year=2021'"""
+    return '/'.join(f"{column}={NULL_PARTITION if value is None else value}"
+                    for column, value in zip(columns, values))
+
+def _canonical_path(relative):
+    """A written partition directory, with the NULL marker of this DuckDB release normalized"""
+    parts = []
+    for part in Path(relative).parts:
+        column, _, value = part.partition('=')
+        parts.append(f"{column}={NULL_PARTITION if value in NULL_MARKERS else value}")
+    return '/'.join(parts)
+
+def _relations(con, database):
+    """(name, [(column, type)]) of the tables and views of an attached database"""
+    relations = {}
+    for name, column, data_type in con.execute("""
+        SELECT table_name, column_name, data_type FROM information_schema.columns
+        WHERE table_catalog = ? AND table_schema = 'main'
+        ORDER BY table_name, ordinal_position
+    """, [database]).fetchall():
+        relations.setdefault(name, []).append((column, data_type))
+    return [(name, columns) for name, columns in relations.items() if name not in SKIPPED_TABLES]
+
+def _source_query(source, columns, partitions):
+    """All columns of a relation plus the partition columns it does not have"""
+    names = set(column for column, _ in columns)
+    derived = [f'{expression} AS "{name}"' for name, expression in partitions if name not in names]
+    return f"SELECT *{''.join(', ' + column for column in derived)} FROM {source}"
+
+def partition_fingerprints(con, source, columns, partitions):
+    """Row count and content hash per partition, keyed by partition path ('' if unpartitioned)"""
+    row_hash = f"hash({', '.join(chr(34) + column + chr(34) for column, _ in columns)})"
+    names = [f'"{name}"' for name, _ in partitions]
+    query = f"""
+        SELECT {''.join(name + ', ' for name in names)}COUNT(*), CAST(SUM({row_hash}) AS VARCHAR)
+        FROM ({_source_query(source, columns, partitions)}) s
+    """
+    if names:
+        query += f" GROUP BY {', '.join(names)}"
+    fingerprints = {}
+    for row in con.execute(query).fetchall():
+        values = list(row[:-2])
+        fingerprints[partition_path([name for name, _ in partitions], values)] = {
+            'values': values, 'rows': row[-2], 'fingerprint': row[-1]
+        }
+    return fingerprints
+
+def _write_partitions(con, source, columns, partitions, keys, target, staging, order):
+    """Write the partitions with the given values under target, replacing what was there"""
+    names = [name for name, _ in partitions]
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    con.register('export_partitions', pd.DataFrame(
+        {name: pd.Series([values[i] for values in keys], dtype=object) for i, name in enumerate(names)}
+    ))
+    matches = " AND ".join(f'k."{name}" IS NOT DISTINCT FROM s."{name}"' for name in names)
+    try:
+        con.execute(f"""
+            COPY (
+                SELECT * FROM ({_source_query(source, columns, partitions)}) s
+                WHERE EXISTS (SELECT 1 FROM export_partitions k WHERE {matches})
+                {'ORDER BY ' + ', '.join(order) if order else ''}
+            ) TO '{staging.as_posix()}'
+            (FORMAT PARQUET, COMPRESSION ZSTD, PARTITION_BY ({', '.join(names)}))
+        """)
+    finally:
+        con.unregister('export_partitions')
+
+    leaves = [leaf for leaf, _, files in os.walk(staging) if any(f.endswith('.parquet') for f in files)]
+    for leaf in leaves:
+        destination = target / _canonical_path(os.path.relpath(leaf, staging))
+        shutil.rmtree(destination, ignore_errors=True)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(leaf, destination)
+    shutil.rmtree(staging)
+
+def _write_table(con, source, target, staging, order):
+    """Write an unpartitioned relation as a single file under target"""
+    staging.mkdir(parents=True, exist_ok=True)
+    part = staging / 'data_0.parquet'
+    con.execute(f"""
+        COPY (SELECT * FROM {source} {'ORDER BY ' + ', '.join(order) if order else ''})
+        TO '{part.as_posix()}' (FORMAT PARQUET, COMPRESSION ZSTD)
+    """)
+    target.mkdir(parents=True, exist_ok=True)
+    os.replace(part, target / 'data_0.parquet')
+    shutil.rmtree(staging)
+
+def _remove_partition(target, path):
+    """Delete a partition directory and the parent directories it leaves empty"""
+    directory = target / path
+    shutil.rmtree(directory, ignore_errors=True)
+    for parent in directory.parents:
+        if parent == target or not parent.is_dir() or any(parent.iterdir()):
+            break
+        parent.rmdir()
+
+def export_relation(con, directory, database, name, columns, previous=None):
+    """Export the partitions of a relation whose content changed since the previous export.
+
+    Returns the relation's manifest entry and the number of partitions
+    written and removed. Without a previous entry the relation is rewritten.
+    """
+    source = f"{database}.main.{name}"
+    partitions = PARTITIONS.get((database, name), [])
+    target = Path(directory) / database / name
+    staging = Path(directory) / '_staging' / database / name
+    order = EXPORT_ORDER.get(name)
+
+    current = partition_fingerprints(con, source, columns, partitions)
+    if previous is None:
+        shutil.rmtree(target, ignore_errors=True)
+    old = (previous or {}).get('partitions', {})
+    changed = [path for path, entry in current.items()
+               if old.get(path, {}).get('fingerprint') != entry['fingerprint']
+               or not (target / (path or 'data_0.parquet')).exists()]
+    removed = [path for path in old if path not in current]
+
+    if changed:
+        if partitions:
+            _write_partitions(con, source, columns, partitions,
+                              [current[path]['values'] for path in changed], target, staging, order)
+        else:
+            _write_table(con, source, target, staging, order)
+    for path in removed:
+        _remove_partition(target, path)
+
+    entry = {
+        'columns': [[column, data_type] for column, data_type in columns],
+        'partition_by': [partition for partition, _ in partitions],
+        'partitions': current,
+    }
+    return entry, len(changed), len(removed)
+
+def load_manifest(directory=EXPORT_DIR):
+    """The manifest of an exported snapshot, or None if there is none"""
+    try:
+        with open(Path(directory) / MANIFEST_NAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def export_parquet(directory=EXPORT_DIR, full=False):
+    """Export the databases as ZSTD Parquet, rewriting only partitions whose rows changed"""
+    try:
+        started = time.perf_counter()
+        main_database, main_path = EXPORT_DATABASES[0]
+        con = duckdb.connect(main_path, read_only=True)
+        for database, path in EXPORT_DATABASES[1:]:
+            con.execute(f"ATTACH '{path}' AS {database} (READ_ONLY)")
+
+        previous = None if full else load_manifest(directory)
+        previous_datasets = (previous or {}).get('datasets', {})
+        if previous is None:
+            for database, _ in EXPORT_DATABASES:
+                shutil.rmtree(Path(directory) / database, ignore_errors=True)
+
+        datasets = {}
+        changed = False
+        for database, _ in EXPORT_DATABASES:
+            datasets[database] = {}
+            for name, columns in _relations(con, database):
+                old = previous_datasets.get(database, {}).get(name) if previous is not None else None
+                if old is not None and old['columns'] != [[c, t] for c, t in columns]:
+                    print(f"Columns of {database}.{name} changed, rewriting it")
+                    old = None
+                entry, written, removed = export_relation(con, directory, database, name, columns, old)
+                datasets[database][name] = entry
+                changed = changed or written > 0 or removed > 0
+                rows = sum(partition['rows'] for partition in entry['partitions'].values())
+                print(f"{database}.{name}: {rows} rows, {written} of {len(entry['partitions'])} "
+                      f"partitions written" + (f", {removed} removed" if removed else ""))
+
+            for name in previous_datasets.get(database, {}):
+                if name not in datasets[database]:
+                    shutil.rmtree(Path(directory) / database / name, ignore_errors=True)
+                    print(f"{database}.{name} no longer exists, removed")
+                    changed = True
+        con.close()
+        shutil.rmtree(Path(directory) / '_staging', ignore_errors=True)
+
+        manifest = {
+            'main': main_database,
+            'exported_at': datetime.now().isoformat(),
+            'data_version': read_data_version(),
+            'datasets': datasets,
+        }
+        manifest_path = Path(directory) / MANIFEST_NAME
+        with open(str(manifest_path) + '.part', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(str(manifest_path) + '.part', manifest_path)
+        if changed or previous is None:
+            # Dashboards reading the snapshot reconnect when this changes
+            write_data_version(str(Path(directory) / 'DATA_VERSION'))
+        print(f"Exported to {directory} in {time.perf_counter() - started:.2f}s")
+        return True
+
+    except Exception as e:
+        print(f"Error exporting Parquet: {e}")
+        if 'con' in locals():
+            con.close()
+        return False
+
+def attach_parquet_snapshot(con, directory=EXPORT_DIR):
+    """Create views over an exported snapshot, named as the dashboard queries the databases.
+
+    Relations of the main database become views in `main`, the others views in
+    a schema named after their database (e.g. prices.daily_prices). Columns are
+    cast back to their database types, and partition columns read back from the
+    directory names.
+    """
+    manifest = load_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No Parquet snapshot in {directory}")
+    for database, relations in manifest['datasets'].items():
+        schema = 'main' if database == manifest['main'] else database
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        for name, entry in relations.items():
+            partition_by = entry['partition_by']
+            if any(partition['rows'] for partition in entry['partitions'].values()):
+                # A NULL partition reads back as its directory marker on older releases
+                projection = ", ".join(
+                    f'{"TRY_CAST" if column in partition_by else "CAST"}("{column}" AS {data_type}) AS "{column}"'
+                    for column, data_type in entry['columns']
+                )
+                files = (Path(directory) / database / name / '**' / '*.parquet').as_posix()
+                source = f"read_parquet('{files}', hive_partitioning = {'true' if partition_by else 'false'})"
+                con.execute(f"CREATE OR REPLACE VIEW {schema}.{name} AS SELECT {projection} FROM {source}")
+            else:
+                projection = ", ".join(f'CAST(NULL AS {data_type}) AS "{column}"'
+                                       for column, data_type in entry['columns'])
+                con.execute(f"CREATE OR REPLACE VIEW {schema}.{name} AS SELECT {projection} WHERE FALSE")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the databases as Hive-partitioned ZSTD Parquet")
+    parser.add_argument("--output", default=EXPORT_DIR, help="Snapshot directory")
+    parser.add_argument("--full", action="store_true",
+                        help="Rewrite every partition instead of only the changed ones")
+    args = parser.parse_args()
+    export_parquet(args.output, full=args.full)
@@ -1,143 +1,408 @@
+import os
+import queue
+import threading
 import duckdb
 import pandas as pd
+from collections import OrderedDict
+from contextlib import contextmanager
+from pipeline_state import DATA_VERSION_PATH, SNAPSHOT_DIR, read_data_version
+from export_parquet import attach_parquet_snapshot
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+def arrow_to_pandas(table):
+    """Arrow-backed DataFrame of a result table, without converting columns to numpy.
+
+    As with fetchdf, DATE columns become timestamps (so they compare against
+    pd.Timestamp values), DECIMAL columns become doubles and ENUM columns
+    (dictionary-encoded in Arrow) become categoricals.
+    """
+    def compatible(field):
+        if pa.types.is_date(field.type):
+            return field.with_type(pa.timestamp('us'))
+        if pa.types.is_decimal(field.type):
+            return field.with_type(pa.float64())
+        return field
+    schema = pa.schema([compatible(field) for field in table.schema])
+    return table.cast(schema).to_pandas(
+        types_mapper=lambda arrow_type: None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+    )
+
+class ResultCache:
+    """Thread-safe LRU of query results bounded by their in-memory size"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        size = int(result.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+            }
 
 class DashboardData:
-    def __init__(self):
+    """Read-only access to the dashboard databases, shared by all Streamlit sessions.
+
+    Queries run on the snapshot the pipeline last published, never on the
+    files it writes, so the pipeline can run while the dashboard is up. One
+    root connection holds the ATTACHes; each query checks out a cursor from
+    a pool, so concurrent sessions query in parallel. Results are cached
+    until a new snapshot is published; the pool is then drained and the
+    connection moved to it. Cached DataFrames are shared between sessions
+    and must not be modified in place.
+
+    In Arrow mode (the default when pyarrow is installed) results are fetched
+    as Arrow tables and wrapped in Arrow-backed DataFrames, so strings stay in
+    Arrow buffers instead of becoming Python objects.
+
+    With parquet_dir set, queries run on an in-memory database over a snapshot
+    written by export_parquet.py instead of the .duckdb files. The snapshot's
+    own DATA_VERSION stamp invalidates the cache.
+    """
+
+    def __init__(self, pool_size=8, cache_bytes=256 * 1024 * 1024, arrow=None, parquet_dir=None):
         """Initialize database connections"""
         self.con = None
+        self.arrow = pa is not None if arrow is None else arrow
+        self.parquet_dir = parquet_dir
+        self.version_path = os.path.join(parquet_dir, 'DATA_VERSION') if parquet_dir else DATA_VERSION_PATH
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # Bumped on every reconnect; cursors of an older root connection are dropped
+        self._generation = 0
+        self.cache = ResultCache(cache_bytes)
+        self.data_version = read_data_version(self.version_path)
         self._connect()
 
     def _connect(self):
-        """Create a new connection"""
-        try:
-            if self.con:
-                try:
-                    self.con.close()
-                except:
-                    pass
-            self.con = duckdb.connect('databases/transactions.duckdb', read_only=True)
-            self.con.execute("ATTACH 'databases/stock_prices.duckdb' AS prices (READ_ONLY)")
-            self.con.execute("ATTACH 'databases/stock_details.duckdb' AS details (READ_ONLY)")
-            self.con.execute("ATTACH 'databases/representatives.duckdb' AS reps (READ_ONLY)")
-        except Exception as e:
-            print(f"Error connecting to database: {e}")
-            self.con = None
+        """Create a new root connection and discard the cursors of the old one"""
+        with self._lock:
+            self._reconnect()
 
-    def close(self):
-        """Close database connection"""
+    def _reconnect(self):
+        """_connect with the lock already held"""
+        self._generation += 1
+        self._drain_pool()
         if self.con:
             try:
                 self.con.close()
             except:
                 pass
+        try:
+            if self.parquet_dir:
+                self.con = duckdb.connect()
+                attach_parquet_snapshot(self.con, self.parquet_dir)
+                return
+            snapshot = os.path.join(SNAPSHOT_DIR, self.data_version or '')
+            if not self.data_version or not os.path.isdir(snapshot):
+                raise FileNotFoundError(f"No published snapshot in {SNAPSHOT_DIR}, "
+                                        "run python pipeline_state.py to publish one")
+            self.con = duckdb.connect(os.path.join(snapshot, 'transactions.duckdb'), read_only=True)
+            for alias, name in [('prices', 'stock_prices'), ('details', 'stock_details'),
+                                ('reps', 'representatives')]:
+                path = os.path.join(snapshot, f'{name}.duckdb').replace("'", "''")
+                # Another connection to this snapshot may have attached it already
+                self.con.execute(f"ATTACH IF NOT EXISTS '{path}' AS {alias} (READ_ONLY)")
+        except Exception as e:
+            print(f"Error connecting to database: {e}")
             self.con = None
 
-    def _check_connection(self):
-        """Ensure connection is active"""
+    def _drain_pool(self):
+        while True:
+            try:
+                _, cursor = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            self._close_cursor(cursor)
+
+    @staticmethod
+    def _close_cursor(cursor):
         try:
+            cursor.close()
+        except:
+            pass
+
+    def close(self):
+        """Close database connection"""
+        with self._lock:
+            self._drain_pool()
             if self.con:
-                # Try a simple query to test connection
-                self.con.execute("SELECT 1").fetchone()
-            else:
+                try:
+                    self.con.close()
+                except:
+                    pass
+                self.con = None
+
+    @contextmanager
+    def _cursor(self):
+        """Check out a cursor, sharing the root connection's ATTACHes.
+
+        Cursors are tagged with the generation of the root connection they
+        came from; those of a connection closed since are dropped, whether
+        they were idle in the pool or checked out during the reconnect.
+        """
+        cursor = None
+        while cursor is None:
+            try:
+                generation, cursor = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation:
+                self._close_cursor(cursor)
+                cursor = None
+        if cursor is None:
+            if self.con is None:
                 self._connect()
+            with self._lock:
+                if self.con is None:
+                    raise duckdb.ConnectionException("No database connection")
+                generation, cursor = self._generation, self.con.cursor()
+        try:
+            yield cursor
+        except Exception:
+            # A cursor that failed may be in a bad state; do not hand it out again
+            self._close_cursor(cursor)
+            raise
+        with self._lock:
+            if generation == self._generation and self._pool.qsize() < self.pool_size:
+                self._pool.put((generation, cursor))
+                return
+        self._close_cursor(cursor)
+
+    def _healthy(self):
+        """Whether the root connection still answers queries"""
+        try:
+            with self._lock:
+                self.con.execute("SELECT 1").fetchone()
+            return True
         except:
-            self._connect()
+            return False
+
+    def _check_data_version(self):
+        """Drop cached results and move to the new snapshot once the pipeline has published one"""
+        version = read_data_version(self.version_path)
+        if version == self.data_version:
+            return
+        # One swap: no query sees the new version on the old connection or the reverse
+        with self._lock:
+            if version == self.data_version:
+                return
+            print(f"Data version changed ({self.data_version} -> {version}), clearing cache")
+            self.data_version = version
+            self._reconnect()
+            self.cache.clear()
+
+    def cache_stats(self):
+        """Hit, miss and eviction counters of the result cache"""
+        return dict(self.cache.stats(), data_version=self.data_version)
+
+    def _query(self, query, params=None):
+        """Run a query, serving repeated (query, params) pairs from the result cache"""
+        self._check_data_version()
+        key = (query, tuple(params or []))
+        result = self.cache.get(key)
+        if result is None:
+            generation = self._generation
+            result = self._execute(query, params)
+            # A result from a connection replaced meanwhile is not cached under the new version
+            with self._lock:
+                if generation == self._generation:
+                    self.cache.put(key, result)
+        return result
+
+    def _execute(self, query, params=None):
+        """Run a query on a pooled cursor and return a DataFrame.
+
+        The connection is only health-checked after a query fails; if it is
+        dead it is reopened and the query retried once, as is a query whose
+        cursor another session's reconnect closed.
+        """
+        generation = self._generation
+        try:
+            with self._cursor() as cursor:
+                return self._fetch(cursor.execute(query, params or []))
+        except duckdb.Error:
+            # A query cut off by another session's reconnect just runs again
+            if generation == self._generation:
+                if self.con is not None and self._healthy():
+                    raise
+                # Another session may already have reconnected
+                if generation == self._generation:
+                    self._connect()
+            with self._cursor() as cursor:
+                return self._fetch(cursor.execute(query, params or []))
+
+    def _fetch(self, result):
+        """Materialize a query result as a DataFrame in the configured result mode"""
+        if not self.arrow:
+            return result.fetchdf()
+        # Newer DuckDB releases renamed fetch_arrow_table to to_arrow_table
+        fetch = getattr(result, 'to_arrow_table', None) or result.fetch_arrow_table
+        return arrow_to_pandas(fetch())
+
+    def _relation_columns(self, relation):
+        """Column names of a dashboard relation, the allowlist for filters and projections"""
+        result = self._query("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_catalog = current_database() AND table_schema = 'main' AND table_name = ?
+        """, [relation])
+        return set(result['column_name'])
 
-    def get_representative_overview(self, representative_name=None):
+    def _where(self, relation, filters=None, start_date=None, end_date=None, date_column='transaction_date'):
+        """WHERE clause and parameters for equality filters and a date range on a relation.
+
+        Filters set to None are ignored. Column names are checked against the
+        relation so only values, never identifiers, come from the caller.
+        """
+        filters = {column: value for column, value in (filters or {}).items() if value is not None}
+        if start_date is not None or end_date is not None:
+            self._check_columns(relation, [date_column])
+        self._check_columns(relation, filters)
+
+        conditions = [f'"{column}" = ?' for column in filters]
+        params = list(filters.values())
+        if start_date is not None:
+            conditions.append(f'"{date_column}" >= ?')
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append(f'"{date_column}" <= ?')
+            params.append(end_date)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def _check_columns(self, relation, columns):
+        unknown = sorted(set(columns) - self._relation_columns(relation))
+        if unknown:
+            raise ValueError(f"Unknown columns for {relation}: {', '.join(unknown)}")
+
+    def _select(self, relation, columns=None, filters=None, start_date=None, end_date=None,
+                date_column='transaction_date', order_by=None):
+        """Filtered, projected rows of a dashboard relation, evaluated inside DuckDB"""
+        if columns:
+            self._check_columns(relation, columns)
+        projection = ", ".join(f'"{column}"' for column in columns) if columns else "*"
+        where, params = self._where(relation, filters, start_date, end_date, date_column)
+        query = f"SELECT {projection} FROM {relation}{where}"
+        if order_by:
+            query += f" ORDER BY {order_by}"
+        return self._query(query, params)
+
+    def get_representative_overview(self, representative_name=None, columns=None):
         """Fetch representative overview data"""
         try:
-            self._check_connection()
-            if representative_name:
-                result = self.con.execute("""
-                    SELECT * FROM rep_overview 
-                    WHERE representative = ?
-                """, [representative_name]).fetchdf()
-            else:
-                result = self.con.execute("SELECT * FROM rep_overview").fetchdf()
-            return result
+            return self._select('rep_overview', columns, {'representative': representative_name})
         except Exception as e:
             print(f"Error fetching representative overview: {e}")
             return pd.DataFrame()
 
-    def get_representative_sector_analysis(self, representative_name=None):
+    def get_representative_sector_analysis(self, representative_name=None, columns=None):
         """Fetch sector analysis data"""
         try:
-            self._check_connection()
-            if representative_name:
-                result = self.con.execute("""
-                    SELECT * FROM representative_sector_analysis 
-                    WHERE representative = ?
-                """, [representative_name]).fetchdf()
-            else:
-                result = self.con.execute("SELECT * FROM representative_sector_analysis").fetchdf()
-            return result
+            return self._select('representative_sector_analysis', columns,
+                                {'representative': representative_name},
+                                order_by="transaction_count DESC")
         except Exception as e:
             print(f"Error fetching sector analysis: {e}")
             return pd.DataFrame()
 
-    def get_portfolio_value_analysis(self, representative_name=None):
+    def get_portfolio_value_analysis(self, representative_name=None, ticker=None, start_date=None,
+                                     end_date=None, columns=None):
         """Fetch portfolio value analysis data"""
         try:
-            self._check_connection()
-            if representative_name:
-                result = self.con.execute("""
-                    SELECT * FROM portfolio_value_analysis 
-                    WHERE representative = ?
-                    ORDER BY transaction_date
-                """, [representative_name]).fetchdf()
-            else:
-                result = self.con.execute("SELECT * FROM portfolio_value_analysis").fetchdf()
-            return result
+            return self._select('portfolio_value_analysis', columns,
+                                {'representative': representative_name, 'ticker': ticker},
+                                start_date, end_date, order_by="transaction_date")
         except Exception as e:
             print(f"Error fetching portfolio value analysis: {e}")
             return pd.DataFrame()
 
-    def get_current_positions(self, representative_name=None):
+    def get_current_positions(self, representative_name=None, ticker=None, columns=None):
         """Fetch current positions data"""
         try:
-            self._check_connection()
-            if representative_name:
-                result = self.con.execute("""
-                    SELECT * FROM current_positions 
-                    WHERE representative = ?
-                    ORDER BY current_value DESC
-                """, [representative_name]).fetchdf()
-            else:
-                result = self.con.execute("SELECT * FROM current_positions").fetchdf()
-            return result
+            return self._select('current_positions', columns,
+                                {'representative': representative_name, 'ticker': ticker},
+                                order_by="current_value DESC")
         except Exception as e:
             print(f"Error fetching current positions: {e}")
             return pd.DataFrame()
 
-    def get_trading_timeline(self, start_date=None, end_date=None):
+    def get_trading_timeline(self, start_date=None, end_date=None, representative_name=None,
+                             ticker=None, columns=None):
         """Fetch trading timeline data"""
         try:
-            self._check_connection()
-            query = "SELECT * FROM trading_timeline WHERE 1=1"
-            params = []
-            
-            if start_date:
-                query += " AND transaction_date >= ?"
-                params.append(start_date)
-            if end_date:
-                query += " AND transaction_date <= ?"
-                params.append(end_date)
-            
-            result = self.con.execute(query, params).fetchdf()
-            return result
+            return self._select('trading_timeline', columns,
+                                {'representative': representative_name, 'ticker': ticker},
+                                start_date, end_date, order_by="transaction_date")
         except Exception as e:
             print(f"Error fetching trading timeline: {e}")
             return pd.DataFrame()
 
+    def get_daily_trade_counts(self, representative_name=None, ticker=None, start_date=None, end_date=None):
+        """Number of trades per day, aggregated in DuckDB"""
+        try:
+            where, params = self._where('trading_timeline',
+                                        {'representative': representative_name, 'ticker': ticker},
+                                        start_date, end_date)
+            return self._query(f"""
+                SELECT transaction_date, COUNT(*) as trades
+                FROM trading_timeline{where or " WHERE TRUE"} AND transaction_date IS NOT NULL
+                GROUP BY transaction_date
+                ORDER BY transaction_date
+            """, params)
+        except Exception as e:
+            print(f"Error fetching daily trade counts: {e}")
+            return pd.DataFrame(columns=['transaction_date', 'trades'])
+
     def get_all_representatives(self):
         """Get list of all representatives"""
         try:
-            self._check_connection()
-            result = self.con.execute("""
+            result = self._query("""
                 SELECT DISTINCT representative as name 
                 FROM transactions 
                 ORDER BY representative
-            """).fetchdf()
+            """)
             return result
         except Exception as e:
             print(f"Error fetching representatives: {e}")
@@ -146,12 +411,11 @@ class DashboardData:
     def get_all_tickers(self):
         """Get list of all tickers"""
         try:
-            self._check_connection()
-            result = self.con.execute("""
+            result = self._query("""
                 SELECT DISTINCT ticker 
                 FROM transactions 
                 ORDER BY ticker
-            """).fetchdf()
+            """)
             return result
         except Exception as e:
             print(f"Error fetching tickers: {e}")
@@ -160,14 +424,13 @@ class DashboardData:
     def get_all_stocks(self):
         """Get list of all stocks with price data"""
         try:
-            self._check_connection()
             # Only return stocks that have price data
-            result = self.con.execute("""
+            result = self._query("""
                 SELECT DISTINCT t.ticker 
                 FROM transactions t
-                INNER JOIN prices.daily_prices p ON t.ticker = p.ticker
+                INNER JOIN prices.daily_prices p ON t.ticker_id = p.ticker_id
                 ORDER BY t.ticker;
-            """).fetchdf()
+            """)
             
             # Debug print
             print(f"Found {len(result)} stocks with price data")
@@ -180,28 +443,18 @@ class DashboardData:
     def get_stock_prices(self, ticker):
         """Get historical prices for a stock"""
         try:
-            self._check_connection()
-            # First, let's verify if the ticker exists in our database
-            check_query = """
-                SELECT COUNT(*) 
-                FROM prices.daily_prices 
-                WHERE ticker = ?;
-            """
-            count = self.con.execute(check_query, [ticker]).fetchone()[0]
-            
-            if count == 0:
-                print(f"No price data found for ticker: {ticker}")
-                return pd.DataFrame()
-            
-            # If ticker exists, fetch the data
-            result = self.con.execute("""
+            result = self._query("""
                 SELECT 
                     date,
                     close
                 FROM prices.daily_prices
                 WHERE ticker = ?
                 ORDER BY date;
-            """, [ticker]).fetchdf()
+            """, [ticker])
+            
+            if result.empty:
+                print(f"No price data found for ticker: {ticker}")
+                return pd.DataFrame()
             
             # Debug print
             print(f"Found {len(result)} price records for {ticker}")
@@ -211,15 +464,44 @@ class DashboardData:
             print(f"Error fetching stock prices: {e}")
             return pd.DataFrame()
 
+    def get_stock_price_range(self, ticker, start_date=None, end_date=None):
+        """Price history bounds and the closes within a date range, in one query.
+
+        Missing start or end dates default to the bounds. Returns (min_date,
+        max_date, prices); the bounds are None if the ticker has no prices.
+        """
+        try:
+            result = self._query("""
+                WITH bounds AS (
+                    SELECT MIN(date) as min_date, MAX(date) as max_date
+                    FROM prices.daily_prices
+                    WHERE ticker = ?
+                )
+                SELECT b.min_date, b.max_date, p.date, p.close
+                FROM bounds b
+                LEFT JOIN prices.daily_prices p
+                    ON p.ticker = ?
+                    AND p.date BETWEEN COALESCE(?::DATE, b.min_date) AND COALESCE(?::DATE, b.max_date)
+                ORDER BY p.date
+            """, [ticker, ticker, start_date, end_date])
+        except Exception as e:
+            print(f"Error fetching stock price range: {e}")
+            return None, None, pd.DataFrame(columns=['date', 'close'])
+
+        if result.empty or pd.isna(result['min_date'].iloc[0]):
+            print(f"No price data found for ticker: {ticker}")
+            return None, None, pd.DataFrame(columns=['date', 'close'])
+        prices = result[['date', 'close']].dropna(subset=['date']).reset_index(drop=True)
+        return result['min_date'].iloc[0], result['max_date'].iloc[0], prices
+
     def get_stock_overview(self, ticker):
         """Get overview statistics for a stock"""
         try:
-            self._check_connection()
-            result = self.con.execute("""
+            result = self._query("""
                 SELECT *
                 FROM stock_overview
                 WHERE ticker = ?;
-            """, [ticker]).fetchdf()
+            """, [ticker])
             return result
         except Exception as e:
             print(f"Error fetching stock overview: {e}")
@@ -228,29 +510,22 @@ class DashboardData:
     def get_stock_positions(self, ticker):
         """Get current positions for a stock"""
         try:
-            self._check_connection()
-            result = self.con.execute("""
+            result = self._query("""
                 SELECT *
                 FROM stock_positions
                 WHERE ticker = ?
                 ORDER BY position_value DESC;
-            """, [ticker]).fetchdf()
+            """, [ticker])
             return result
         except Exception as e:
             print(f"Error fetching stock positions: {e}")
             return pd.DataFrame()
 
-    def get_stock_trading_timeline(self, ticker):
+    def get_stock_trading_timeline(self, ticker, start_date=None, end_date=None, columns=None):
         """Get trading timeline for a stock"""
         try:
-            self._check_connection()
-            result = self.con.execute("""
-                SELECT *
-                FROM stock_trading_timeline
-                WHERE ticker = ?
-                ORDER BY transaction_date;
-            """, [ticker]).fetchdf()
-            return result
+            return self._select('stock_trading_timeline', columns, {'ticker': ticker},
+                                start_date, end_date, order_by="transaction_date")
         except Exception as e:
             print(f"Error fetching stock trading timeline: {e}")
             return pd.DataFrame()
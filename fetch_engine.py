@@ -0,0 +1,209 @@
+import queue
+import random
+import asyncio
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from fetch_utils import is_rate_limited
+
+# Concurrent requests allowed per host, below the engine-wide concurrency
+HOST_LIMITS = {
+    'query2.finance.yahoo.com': 8,
+    'house-stock-watcher-data.s3-us-west-2.amazonaws.com': 2,
+}
+
+# Seconds between attempts to take a host slot held by another job
+SLOT_POLL_INTERVAL = 0.05
+
+class FetchEngine:
+    """Shared asyncio engine for outbound market-data I/O.
+
+    Blocking calls (requests, yfinance) run on a worker pool under per-host
+    concurrency limits, an optional shared rate limiter, per-attempt timeouts
+    and jittered exponential retries. Results are yielded as they complete.
+
+    The per-host limits hold across every fetch made through one engine, even
+    concurrent ones from different threads; use shared_engine() so all modules
+    in a process go through the same one.
+    """
+
+    def __init__(self, concurrency=8, limiter=None, retries=3, base_delay=1.0, max_delay=30.0,
+                 timeout=60.0, host_limits=None):
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.host_limits = HOST_LIMITS if host_limits is None else host_limits
+        self._host_slots = {}
+        self._slots_lock = threading.Lock()
+        self._users = 1
+
+        # One pooled HTTP session for every request made through the engine
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def host_limit(self, host):
+        """Concurrent requests allowed against a host"""
+        return min(self.concurrency, self.host_limits.get(host, self.concurrency))
+
+    def host_slots(self, host):
+        """The semaphore bounding concurrent requests to a host, shared by all fetches"""
+        with self._slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.host_limit(host))
+            return self._host_slots[host]
+
+    @staticmethod
+    async def _acquire(slots):
+        # A thread semaphore, since concurrent fetch() calls each run their own event
+        # loop; polled rather than waited on so a cancelled job never leaks a slot
+        while not slots.acquire(blocking=False):
+            await asyncio.sleep(SLOT_POLL_INTERVAL)
+
+    async def _run(self, key, fn, semaphore, slots, retry_if, label, limiter, retries, timeout):
+        attempt = 0
+        while True:
+            async with semaphore:
+                await self._acquire(slots)
+                try:
+                    if limiter:
+                        await asyncio.to_thread(limiter.acquire)
+                    result = await asyncio.wait_for(asyncio.to_thread(fn), timeout)
+                except asyncio.TimeoutError:
+                    error = TimeoutError(f"timed out after {timeout}s")
+                except Exception as e:
+                    error = e
+                else:
+                    if hasattr(limiter, 'on_success'):
+                        limiter.on_success()
+                    return key, result, None
+                finally:
+                    slots.release()
+
+            # Back off outside the semaphore so waiting does not hold a slot
+            if is_rate_limited(error) and hasattr(limiter, 'on_throttled'):
+                limiter.on_throttled()
+            if attempt >= retries or (retry_if and not retry_if(error)):
+                return key, None, error
+            delay = min(self.max_delay, self.base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            attempt += 1
+            print(f"Retrying {label(key)} in {delay:.1f}s ({attempt}/{retries}): {error}")
+            await asyncio.sleep(delay)
+
+    async def afetch(self, jobs, host=None, retry_if=None, label=str, concurrency=None,
+                     limiter=None, retries=None, timeout=None):
+        """Run (key, fn) jobs concurrently, yielding (key, result, error) as each completes.
+
+        concurrency, limiter, retries and timeout override the engine's
+        defaults for this call only; the host limit always applies.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        slots = self.host_slots(host)
+        limiter = self.limiter if limiter is None else limiter
+        retries = self.retries if retries is None else retries
+        timeout = self.timeout if timeout is None else timeout
+        tasks = [
+            asyncio.ensure_future(self._run(key, fn, semaphore, slots, retry_if, label,
+                                            limiter, retries, timeout))
+            for key, fn in jobs
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def fetch(self, jobs, host=None, retry_if=None, label=str, **settings):
+        """Synchronous wrapper around afetch for callers without an event loop.
+
+        The loop runs on a background thread; results are handed back to the
+        calling thread, so it can keep doing all database writes itself.
+        Closing the generator early (break, KeyboardInterrupt) cancels the
+        outstanding jobs.
+        """
+        results = queue.Queue()
+        finished = object()
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=(settings.get('concurrency') or self.concurrency) * 2)
+        loop.set_default_executor(executor)
+
+        async def produce():
+            try:
+                async for item in self.afetch(jobs, host, retry_if, label, **settings):
+                    results.put(item)
+            except Exception as e:
+                results.put(e)
+            finally:
+                results.put(finished)
+
+        def run():
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                pass
+
+        task = loop.create_task(produce())
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = results.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            loop.call_soon_threadsafe(task.cancel)
+            thread.join()
+            loop.close()
+            # Timed-out calls cannot be interrupted; do not wait for them
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get(self, url, retry_statuses=(429, 500, 502, 503, 504), **kwargs):
+        """GET through the pooled session with the engine's limits, timeout and retries"""
+        kwargs.setdefault('timeout', self.timeout)
+
+        def request():
+            response = self.session.get(url, **kwargs)
+            if response.status_code in retry_statuses:
+                response.close()
+                response.raise_for_status()
+            return response
+
+        for _, response, error in self.fetch([(url, request)], host=urlparse(url).hostname):
+            if error:
+                raise error
+            return response
+
+    def close(self):
+        """Release the engine; the session closes once its last user has closed it"""
+        with _shared_lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+        self.session.close()
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def shared_engine():
+    """The process-wide engine, so concurrent fetches share one session and the host limits.
+
+    Every caller closes it when done, as with an engine of its own.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None or _shared._users <= 0:
+            _shared = FetchEngine()
+        else:
+            _shared._users += 1
+        return _shared
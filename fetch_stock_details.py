@@ -1,14 +1,42 @@
-import yfinance as yf
 import pandas as pd
-import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import duckdb
-from pathlib import Path
-import time
+import argparse
+from market_data import PROVIDERS, get_provider
+from run_journal import RunJournal
+from pipeline_state import bump_data_version, record_changes
+from fetch_utils import AdaptiveRateLimiter, is_rate_limited
+from fetch_engine import shared_engine
+from ticker_registry import TickerRegistry, classify_error
+from dimensions import ticker_ids, assign_ticker_ids
 
-def fetch_stock_details():
+def store_details(con_details, stock_details):
+    """Replace the stored details of a batch of stocks"""
+    df = pd.DataFrame(stock_details)
+    con_details.register('df', df)
+    con_details.execute("DELETE FROM stocks WHERE ticker IN (SELECT ticker FROM df)")
+    columns = ", ".join(df.columns)
+    con_details.execute(f"""
+        INSERT INTO stocks ({columns})
+        SELECT {columns} FROM df
+    """)
+    con_details.unregister('df')
+    record_changes(con_details, 'ticker', df['ticker'])
+
+def select_stale_tickers(con_details, tickers, ttl_days):
+    """Tickers with no stored details, or details older than ttl_days"""
+    cutoff = datetime.now().date() - timedelta(days=ttl_days)
+    stored = dict(con_details.execute("SELECT ticker, last_updated_date FROM stocks").fetchall())
+    return [
+        ticker for ticker in tickers
+        if stored.get(ticker) is None or stored[ticker] < cutoff
+    ]
+
+def fetch_stock_details(provider=None, new_run=False, retry_failed=False, ttl_days=None,
+                        workers=4, timeout=30.0, ignore_registry=False):
     """Fetch company information for all tickers in the dataset"""
     try:
+        provider = get_provider(provider)
         print("Connecting to database...")
         con_transactions = duckdb.connect('databases/transactions.duckdb')
         con_details = duckdb.connect('databases/stock_details.duckdb')
@@ -26,19 +54,47 @@ def fetch_stock_details():
         tickers = [t[0] for t in tickers]
         print(f"Found {len(tickers)} unique tickers")
         
+        # In refresh mode only new tickers and details older than the TTL are fetched
+        if ttl_days is not None:
+            tickers = select_stale_tickers(con_details, tickers, ttl_days)
+            print(f"{len(tickers)} tickers are new or older than {ttl_days} days")
+        
+        # Resume an interrupted run from its journal instead of starting over
+        journal = RunJournal(con_details, 'details')
+        tickers = journal.start(tickers, new_run=new_run, retry_failed=retry_failed)
+        
+        # Skip symbols known to be dead until their next retry is due
+        registry = TickerRegistry(con_details, 'details')
+        if not ignore_registry:
+            tickers, skipped = registry.eligible(tickers)
+            for ticker in skipped:
+                journal.mark_done(ticker)
+            if skipped:
+                print(f"Skipping {len(skipped)} delisted, invalid or data-less tickers "
+                      f"(see python ticker_registry.py status)")
+        
         # Prepare data storage
         stock_details = []
         failed_tickers = []
         
-        # Fetch details for each ticker
+        # Pace requests adaptively, starting from the provider's expected delay;
+        # only rate-limit errors are retried
+        limiter = AdaptiveRateLimiter(1.0 / provider.request_delay) if provider.request_delay else None
+        engine = shared_engine()
+        provider.session = engine.session
+        jobs = [(ticker, lambda t=ticker: provider.info(t)) for ticker in tickers]
+        
+        # Fetch details for each ticker as responses come in
         print("\nFetching stock details...")
-        for i, ticker in enumerate(tickers, 1):
+        for i, (ticker, info, error) in enumerate(
+                engine.fetch(jobs, host=provider.host, retry_if=is_rate_limited,
+                             concurrency=workers, limiter=limiter, timeout=timeout), 1):
             try:
-                print(f"Processing {ticker} ({i}/{len(tickers)})...")
-                
-                # Get stock info from Yahoo Finance
-                stock = yf.Ticker(ticker)
-                info = stock.info
+                if error:
+                    raise error
+                if not info or not (info.get('longName') or info.get('shortName')):
+                    raise KeyError(f"No data found for {ticker}")
+                print(f"Processed {ticker} ({i}/{len(tickers)})")
                 
                 # Extract relevant information
                 details = {
@@ -57,31 +113,36 @@ def fetch_stock_details():
                 
                 stock_details.append(details)
                 
-                # Insert into database every 10 stocks or at the end
-                if len(stock_details) >= 10 or i == len(tickers):
-                    df = pd.DataFrame(stock_details)
-                    con_details.execute("DELETE FROM stocks WHERE ticker IN (SELECT ticker FROM df)")
-                    con_details.register('df', df)
-                    con_details.execute("""
-                        INSERT INTO stocks 
-                        SELECT * FROM df
-                    """)
+                # Insert into database every 10 stocks; tickers count as done once stored
+                if len(stock_details) >= 10:
+                    store_details(con_details, stock_details)
+                    for stored in stock_details:
+                        journal.mark_done(stored['ticker'])
+                        registry.record_success(stored['ticker'])
                     stock_details = []  # Clear the list
                 
-                # Add delay to avoid rate limiting
-                time.sleep(1)
-                
             except Exception as e:
                 print(f"Error processing {ticker}: {str(e)}")
-                failed_tickers.append({'ticker': ticker, 'error': str(e)})
+                failed_tickers.append(ticker)
+                journal.mark_failed(ticker, e)
+                if classify_error(e):
+                    registry.record_failure(ticker, classify_error(e), e)
+        engine.close()
         
-        # Save failed tickers for reference
+        if stock_details:
+            store_details(con_details, stock_details)
+            for stored in stock_details:
+                journal.mark_done(stored['ticker'])
+                registry.record_success(stored['ticker'])
+        print(f"Run {journal.run_id} {journal.finish()}")
+        
+        # Failures are kept in the journal and, for dead symbols, the ticker registry
         if failed_tickers:
-            Path("data").mkdir(exist_ok=True)
-            with open("data/failed_stock_details.json", "w") as f:
-                json.dump(failed_tickers, f, indent=4)
             print(f"\nFailed to fetch data for {len(failed_tickers)} tickers")
-            print("Failed tickers saved to data/failed_stock_details.json")
+            print("See python run_journal.py status and python ticker_registry.py status")
+        
+        # Key the new rows by the ticker dimension
+        assign_ticker_ids(con_details, 'stocks', ticker_ids(con_transactions))
         
         # Verify data
         count = con_details.execute("SELECT COUNT(*) FROM stocks").fetchone()[0]
@@ -89,6 +150,7 @@ def fetch_stock_details():
         
         con_transactions.close()
         con_details.close()
+        bump_data_version()
         return True
         
     except Exception as e:
@@ -100,4 +162,21 @@ def fetch_stock_details():
         return False
 
 if __name__ == "__main__":
-    fetch_stock_details() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch company details for all traded tickers")
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default=None,
+                        help="Market data provider (default: $MARKET_DATA_PROVIDER or yahoo)")
+    parser.add_argument("--new-run", action="store_true",
+                        help="Start a new run even if the last one was interrupted")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Only retry the tickers that failed in the last run")
+    parser.add_argument("--ttl-days", type=int, default=None,
+                        help="Refresh mode: only fetch new tickers and details older than this")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests")
+    parser.add_argument("--ignore-registry", action="store_true",
+                        help="Also request tickers the registry marks as delisted, invalid or without data")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds before a request is abandoned")
+    args = parser.parse_args()
+    fetch_stock_details(provider=args.provider, new_run=args.new_run,
+                        retry_failed=args.retry_failed, ttl_days=args.ttl_days,
+                        workers=args.workers, timeout=args.timeout,
+                        ignore_registry=args.ignore_registry) 
\ No newline at end of file
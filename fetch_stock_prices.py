@@ -1,13 +1,178 @@
-import yfinance as yf
 import pandas as pd
-import json
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 import duckdb
-from pathlib import Path
+import argparse
+from fetch_utils import TokenBucket, ProgressTracker
+from fetch_engine import shared_engine
+from market_data import PROVIDERS, get_provider
+from run_journal import RunJournal
+from pipeline_state import bump_data_version, record_changes
+from ticker_registry import TickerRegistry, classify_error
+from dimensions import ticker_ids, assign_ticker_ids
 
-def fetch_stock_prices():
+def store_prices(con_prices, ticker, hist, replace=True):
+    """Replace the stored prices of one ticker, or upsert them on (ticker, date)"""
+    # Prepare data for database
+    hist = hist.reset_index()
+    hist['ticker'] = ticker
+    hist.rename(columns={
+        'Date': 'date',
+        'Open': 'open',
+        'High': 'high',
+        'Low': 'low',
+        'Close': 'close',
+        'Volume': 'volume'
+    }, inplace=True)
+    # Bars are stamped at exchange-local midnight; keep that calendar date
+    if hist['date'].dt.tz is not None:
+        hist['date'] = hist['date'].dt.tz_localize(None)
+    
+    # Insert into database
+    if replace:
+        con_prices.execute("DELETE FROM daily_prices WHERE ticker = ?", [ticker])
+    con_prices.register('hist_df', hist)
+    con_prices.execute(f"""
+        INSERT {'' if replace else 'OR REPLACE '}INTO daily_prices 
+            (ticker, date, open, high, low, close, volume)
+        SELECT ticker, CAST(date AS DATE), open, high, low, close, volume
+        FROM hist_df
+    """)
+    con_prices.unregister('hist_df')
+    record_changes(con_prices, 'ticker', [ticker])
+
+def ensure_coverage_table(con_prices):
+    """Per-ticker date window that has already been requested from the provider,
+    and the gaps inside it the provider has already answered"""
+    con_prices.execute("""
+        CREATE TABLE IF NOT EXISTS price_coverage (
+            ticker VARCHAR PRIMARY KEY,
+            requested_start DATE,
+            requested_end DATE,
+            updated_at TIMESTAMP
+        )
+    """)
+    con_prices.execute("""
+        CREATE TABLE IF NOT EXISTS answered_gaps (
+            ticker VARCHAR,
+            gap_start DATE,
+            gap_end DATE,
+            answered_at TIMESTAMP
+        )
+    """)
+
+def record_coverage(con_prices, ticker, start, end, replace=False):
+    """Extend (or, after a full refetch, reset) the requested window of a ticker.
+
+    A window inside the one already covered is a gap request; it is logged as
+    answered so days the provider has no price for are not asked for again.
+    """
+    if replace:
+        con_prices.execute("""
+            INSERT OR REPLACE INTO price_coverage VALUES (?, ?, ?, current_timestamp)
+        """, [ticker, start, end])
+        con_prices.execute("DELETE FROM answered_gaps WHERE ticker = ?", [ticker])
+        return
+    con_prices.execute("""
+        INSERT INTO answered_gaps
+        SELECT ticker, ?, ?, current_timestamp FROM price_coverage
+        WHERE ticker = ? AND requested_start <= ? AND requested_end >= ?
+    """, [start, end, ticker, start, end])
+    con_prices.execute("""
+        INSERT OR REPLACE INTO price_coverage
+        SELECT ?, LEAST(?, COALESCE(MIN(requested_start), ?)), GREATEST(?, COALESCE(MAX(requested_end), ?)),
+               current_timestamp
+        FROM price_coverage WHERE ticker = ?
+    """, [ticker, start, start, end, end, ticker])
+
+def find_price_gaps(con_prices, tickers, repair=False):
+    """Interior runs of trading days missing from daily_prices, as (ticker, start, end) windows.
+
+    The trading-day calendar is every date any ticker has a price for. Days inside a
+    gap the provider already answered are skipped unless `repair` is set: it has had
+    its chance to fill those (halts, late listings).
+    """
+    answered_filter = "" if repair else """AND NOT EXISTS (
+                SELECT 1 FROM answered_gaps a
+                WHERE a.ticker = s.ticker AND c.date >= a.gap_start AND c.date < a.gap_end
+            )"""
+    con_prices.register('wanted_tickers', pd.DataFrame({'ticker': tickers}))
+    gaps = con_prices.execute(f"""
+        WITH calendar AS (
+            SELECT date, ROW_NUMBER() OVER (ORDER BY date) as day_index
+            FROM (SELECT DISTINCT date FROM daily_prices)
+        ),
+        stored AS (
+            SELECT p.ticker, MIN(p.date) as first_date, MAX(p.date) as last_date
+            FROM daily_prices p
+            JOIN wanted_tickers w ON w.ticker = p.ticker
+            GROUP BY p.ticker
+        ),
+        missing_days AS (
+            SELECT s.ticker, c.date, c.day_index
+            FROM stored s
+            JOIN calendar c ON c.date BETWEEN s.first_date AND s.last_date
+            WHERE NOT EXISTS (
+                SELECT 1 FROM daily_prices p WHERE p.ticker = s.ticker AND p.date = c.date
+            )
+            {answered_filter}
+        )
+        SELECT ticker, MIN(date) as gap_start, CAST(MAX(date) + INTERVAL 1 DAY AS DATE) as gap_end
+        FROM (
+            SELECT *, day_index - ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY day_index) as island
+            FROM missing_days
+        )
+        GROUP BY ticker, island
+        ORDER BY ticker, gap_start
+    """).fetchall()
+    con_prices.unregister('wanted_tickers')
+    return gaps
+
+def plan_incremental_requests(con_prices, tickers, start_date, end_date, repair_gaps=False):
+    """Windows still missing per ticker: history before the stored range, new days since, and gaps"""
+    con_prices.register('wanted_tickers', pd.DataFrame({'ticker': tickers}))
+    coverage = con_prices.execute("""
+        SELECT w.ticker, MIN(p.date), MAX(p.date), MIN(c.requested_start), MAX(c.requested_end)
+        FROM wanted_tickers w
+        LEFT JOIN daily_prices p ON p.ticker = w.ticker
+        LEFT JOIN price_coverage c ON c.ticker = w.ticker
+        GROUP BY w.ticker
+    """).fetchall()
+    con_prices.unregister('wanted_tickers')
+    
+    requests = []
+    for ticker, first_date, last_date, requested_start, requested_end in coverage:
+        starts = [d for d in (first_date, requested_start) if d is not None]
+        ends = [d for d in (last_date + timedelta(days=1) if last_date else None, requested_end)
+                if d is not None]
+        if not starts:
+            requests.append((ticker, start_date, end_date))
+            continue
+        covered_from, covered_to = min(starts), max(ends)
+        if start_date < covered_from:
+            requests.append((ticker, start_date, covered_from))
+        if covered_to < end_date:
+            requests.append((ticker, covered_to, end_date))
+    
+    requests += find_price_gaps(con_prices, tickers, repair=repair_gaps)
+    return requests
+
+def batch_requests(requests, batch_size):
+    """Group (ticker, start, end) requests sharing a window into provider-sized batches"""
+    windows = {}
+    for ticker, start, end in requests:
+        windows.setdefault((start, end), []).append(ticker)
+    batches = []
+    for (start, end), window_tickers in windows.items():
+        for i in range(0, len(window_tickers), batch_size):
+            batches.append((window_tickers[i:i + batch_size], start, end))
+    return batches
+
+def fetch_stock_prices(workers=8, rate=5.0, retries=3, provider=None, incremental=False,
+                       repair_gaps=False, new_run=False, retry_failed=False, timeout=120.0,
+                       ignore_registry=False):
     """Fetch historical stock prices for all tickers in the dataset"""
     try:
+        provider = get_provider(provider)
         print("Connecting to databases...")
         con_trans = duckdb.connect('databases/transactions.duckdb')
         con_prices = duckdb.connect('databases/stock_prices.duckdb')
@@ -40,55 +205,116 @@ def fetch_stock_prices():
         print(f"Found {len(tickers)} unique tickers")
         print(f"Date range: {start_date} to {end_date}")
         
-        # Fetch and store prices for each ticker
-        print("\nFetching stock prices...")
+        # Resume an interrupted run from its journal instead of starting over
+        journal = RunJournal(con_prices, 'prices')
+        tickers = journal.start(tickers, new_run=new_run, retry_failed=retry_failed)
+        
+        # Skip symbols known to be dead until their next retry is due
+        registry = TickerRegistry(con_prices, 'prices')
+        if not ignore_registry:
+            tickers, skipped = registry.eligible(tickers)
+            for ticker in skipped:
+                journal.mark_done(ticker)
+            if skipped:
+                print(f"Skipping {len(skipped)} delisted, invalid or data-less tickers "
+                      f"(see python ticker_registry.py status)")
+        
+        # Never treat future (or today's still-moving) prices as fetched
+        request_end = min(end_date, date.today() + timedelta(days=1))
+        covered_end = min(end_date, date.today())
+        
+        ensure_coverage_table(con_prices)
+        if incremental:
+            requests = plan_incremental_requests(con_prices, tickers, start_date, request_end, repair_gaps)
+            print(f"{len(requests)} missing ranges across {len(set(r[0] for r in requests))} tickers")
+        else:
+            requests = [(ticker, start_date, request_end) for ticker in tickers]
+        
+        # Fetch prices concurrently in provider-sized batches; all database writes stay on this thread
+        batches = batch_requests(requests, provider.batch_size)
+        print(f"\nFetching stock prices from {provider.name} in {len(batches)} requests "
+              f"with {workers} workers at up to {rate} requests/s...")
         failed_tickers = []
+        # The process-wide engine, so a details fetch running alongside shares the host limit
+        engine = shared_engine()
+        provider.session = engine.session
+        progress = ProgressTracker(len(requests), label="ticker ranges")
+        jobs = [
+            (i, lambda b=batch, s=start, e=end: provider.history(b, s, e))
+            for i, (batch, start, end) in enumerate(batches)
+        ]
         
-        for i, ticker in enumerate(tickers, 1):
-            try:
-                print(f"Processing {ticker} ({i}/{len(tickers)})...")
-                
-                # Get stock data from Yahoo Finance
-                stock = yf.Ticker(ticker)
-                hist = stock.history(start=start_date, end=end_date)
-                
-                if hist.empty:
-                    print(f"No data found for {ticker}")
+        for i, histories, error in engine.fetch(
+                jobs, host=provider.host, label=lambda i: f"{batches[i][0][0]}..{batches[i][0][-1]}",
+                concurrency=workers, limiter=TokenBucket(rate), retries=retries, timeout=timeout):
+            batch, start, end = batches[i]
+            if error:
+                print(f"Error processing {', '.join(batch)}: {str(error)}")
+                for ticker in batch:
+                    failed_tickers.append(ticker)
+                    journal.mark_failed(ticker, error)
+                    progress.update(ok=False)
+                if len(batch) == 1 and classify_error(error):
+                    registry.record_failure(batch[0], classify_error(error), error)
+                continue
+            
+            for ticker in batch:
+                try:
+                    hist = histories.get(ticker)
+                    if hist is None:
+                        # Not an answer for this ticker, so its window is not covered
+                        raise RuntimeError(f"{provider.name} returned no result for {ticker}")
+                    if isinstance(hist, Exception):
+                        # This ticker's request failed; the rest of the batch may still be good
+                        if classify_error(hist):
+                            registry.record_failure(ticker, classify_error(hist), hist)
+                        raise hist
+                    
+                    if hist.empty:
+                        if incremental:
+                            # The provider answered with no trading days; a failed request
+                            # comes back as an exception and never reaches this point
+                            record_coverage(con_prices, ticker, start, min(end, covered_end))
+                            journal.mark_done(ticker)
+                            progress.update()
+                            continue
+                        print(f"No data found for {ticker}")
+                        failed_tickers.append(ticker)
+                        journal.mark_failed(ticker, "No data found")
+                        registry.record_failure(ticker, 'no-data', "No data found")
+                        progress.update(ok=False)
+                        continue
+                    
+                    store_prices(con_prices, ticker, hist, replace=not incremental)
+                    record_coverage(con_prices, ticker, start, min(end, covered_end),
+                                    replace=not incremental)
+                    journal.mark_done(ticker)
+                    registry.record_success(ticker)
+                    progress.update(rows=len(hist))
+                    
+                except Exception as e:
+                    print(f"Error processing {ticker}: {str(e)}")
                     failed_tickers.append(ticker)
-                    continue
-                
-                # Prepare data for database
-                hist.reset_index(inplace=True)
-                hist['ticker'] = ticker
-                hist.rename(columns={
-                    'Date': 'date',
-                    'Open': 'open',
-                    'High': 'high',
-                    'Low': 'low',
-                    'Close': 'close',
-                    'Volume': 'volume'
-                }, inplace=True)
-                
-                # Insert into database
-                con_prices.execute("DELETE FROM daily_prices WHERE ticker = ?", [ticker])
-                con_prices.register('hist_df', hist)
-                con_prices.execute("""
-                    INSERT INTO daily_prices 
-                    SELECT ticker, date, open, high, low, close, volume
-                    FROM hist_df
-                """)
-                
-            except Exception as e:
-                print(f"Error processing {ticker}: {str(e)}")
-                failed_tickers.append(ticker)
-        
-        # Save failed tickers for reference
+                    journal.mark_failed(ticker, e)
+                    progress.update(ok=False)
+        engine.close()
+        
+        progress.summary()
+        
+        # Tickers with nothing left to request are done as well
+        requested = set(r[0] for r in requests)
+        for ticker in tickers:
+            if ticker not in requested:
+                journal.mark_done(ticker)
+        print(f"Run {journal.run_id} {journal.finish()}")
+        
+        # Failures are kept in the journal and, for dead symbols, the ticker registry
         if failed_tickers:
-            Path("data").mkdir(exist_ok=True)
-            with open("data/failed_tickers.json", "w") as f:
-                json.dump(failed_tickers, f, indent=4)
             print(f"\nFailed to fetch data for {len(failed_tickers)} tickers")
-            print("Failed tickers saved to data/failed_tickers.json")
+            print("See python run_journal.py status and python ticker_registry.py status")
+        
+        # Key the new rows by the ticker dimension
+        assign_ticker_ids(con_prices, 'daily_prices', ticker_ids(con_trans))
         
         # Verify data
         count = con_prices.execute("SELECT COUNT(*) FROM daily_prices").fetchone()[0]
@@ -97,6 +323,7 @@ def fetch_stock_prices():
         
         con_trans.close()
         con_prices.close()
+        bump_data_version()
         return True
         
     except Exception as e:
@@ -108,4 +335,26 @@ def fetch_stock_prices():
         return False
 
 if __name__ == "__main__":
-    fetch_stock_prices() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch daily prices for all traded tickers")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent download workers")
+    parser.add_argument("--rate", type=float, default=5.0, help="Maximum requests per second")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per request on errors")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds before a request is abandoned")
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default=None,
+                        help="Market data provider (default: $MARKET_DATA_PROVIDER or yahoo)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch ranges missing from daily_prices instead of full histories")
+    parser.add_argument("--repair-gaps", action="store_true",
+                        help="With --incremental, also refetch interior gaps the provider already answered")
+    parser.add_argument("--new-run", action="store_true",
+                        help="Start a new run even if the last one was interrupted")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Only retry the tickers that failed in the last run")
+    parser.add_argument("--ignore-registry", action="store_true",
+                        help="Also request tickers the registry marks as delisted, invalid or without data")
+    args = parser.parse_args()
+    fetch_stock_prices(workers=args.workers, rate=args.rate, retries=args.retries,
+                       provider=args.provider, incremental=args.incremental,
+                       repair_gaps=args.repair_gaps, new_run=args.new_run,
+                       retry_failed=args.retry_failed, timeout=args.timeout,
+                       ignore_registry=args.ignore_registry)  
\ No newline at end of file
@@ -0,0 +1,91 @@
+import time
+import threading
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` tokens are available, then take them"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ProgressTracker:
+    """Counts finished items and reports throughput"""
+
+    def __init__(self, total, label="items", every=50):
+        self.total = total
+        self.label = label
+        self.every = every
+        self.done = 0
+        self.failed = 0
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def update(self, ok=True, rows=0):
+        """Record one finished item, printing a progress line every `every` items"""
+        self.done += 1
+        self.rows += rows
+        if not ok:
+            self.failed += 1
+        if self.done % self.every == 0 and self.done < self.total:
+            elapsed = time.monotonic() - self.started
+            print(f"Progress: {self.done}/{self.total} {self.label} "
+                  f"({self.done / elapsed:.1f}/s, {self.failed} failed)")
+
+    def summary(self):
+        """Print totals and throughput for the whole run"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        print(f"\nProcessed {self.done}/{self.total} {self.label} in {elapsed:.1f}s "
+              f"({self.done / elapsed:.2f} {self.label}/s, {self.rows / elapsed:.0f} rows/s)")
+        print(f"Succeeded: {self.done - self.failed}, failed: {self.failed}, rows: {self.rows}")
+
+class AdaptiveRateLimiter(TokenBucket):
+    """Token bucket that speeds up while responses are healthy and backs off on rate limiting.
+
+    Additive increase after each success, multiplicative decrease on a 429, bounded
+    by min_rate and max_rate (requests per second).
+    """
+
+    def __init__(self, rate, min_rate=0.1, max_rate=10.0, increase=0.05, decrease=0.5):
+        super().__init__(rate, capacity=1)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Drain the bucket so the next request waits a full (slower) interval
+            self._refill()
+            self.tokens = 0.0
+
+def is_rate_limited(error):
+    """Whether an exception from a provider means we are being rate limited (HTTP 429)"""
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return '429' in text or 'too many requests' in text or 'ratelimit' in text or 'rate limit' in text
@@ -1,57 +1,292 @@
-from fetch_data import fetch_transaction_data, fetch_stock_prices, fetch_stock_details
-from validate_data import validate_all_data
-from setup_database import create_database_schema, load_data_to_database
-from create_views import create_dashboard_views
-from datetime import datetime, timedelta
-
-def run_pipeline():
-    """Run the complete data pipeline"""
+import json
+import time
+import duckdb
+import hashlib
+import argparse
+from datetime import date, datetime
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collect_data import fetch_transaction_data
+from setup_database_schema import (
+    create_transactions_tables, create_stock_prices_tables, create_stock_details_tables,
+    create_representatives_tables, import_initial_data, propagate_dimension_keys, LOADERS
+)
+from fetch_stock_prices import fetch_stock_prices
+from fetch_stock_details import fetch_stock_details
+from compact_storage import compact_storage
+from create_views import create_dashboard_views, DASHBOARD_RELATIONS, DERIVED_TABLES, DERIVED_VIEWS
+from export_parquet import export_parquet, EXPORT_DIR, MANIFEST_NAME
+from pipeline_state import file_fingerprint, table_fingerprint, deferred_publish
+
+# Fingerprint of each stage's inputs and outputs right after its last successful run
+STAGE_STATE_PATH = "databases/pipeline_stages.json"
+
+DATABASES = {
+    'transactions': 'databases/transactions.duckdb',
+    'prices': 'databases/stock_prices.duckdb',
+    'details': 'databases/stock_details.duckdb',
+    'representatives': 'databases/representatives.duckdb',
+}
+
+def _source_fingerprints(*modules):
+    """Content hashes of pipeline modules, so changed code reruns its stage"""
+    return [file_fingerprint(Path(__file__).parent / module) for module in modules]
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+def _table_fingerprints(*tables):
+    """Content fingerprints of (database, table) pairs"""
+    fingerprints = []
+    for database, table in tables:
+        con = duckdb.connect(DATABASES[database])
+        fingerprints.append(table_fingerprint(con, table))
+        con.close()
+    return fingerprints
+
+def _relation_types(database, names):
+    """Type of each named relation of a database ('VIEW', 'BASE TABLE' or None if missing)"""
+    con = duckdb.connect(DATABASES[database])
+    types = dict(con.execute("""
+        SELECT table_name, table_type FROM information_schema.tables
+        WHERE table_catalog = current_database() AND table_schema = 'main'
+    """).fetchall())
+    con.close()
+    return [types.get(name) for name in names]
+
+def _traded_tickers():
+    """Fingerprint of the traded tickers and trade date range, what the market data fetches cover"""
+    con = duckdb.connect(DATABASES['transactions'])
+    row = con.execute("""
+        SELECT COUNT(DISTINCT ticker), CAST(SUM(DISTINCT hash(ticker)) AS VARCHAR),
+               MIN(transaction_date), MAX(transaction_date)
+        FROM transactions
+        WHERE ticker IS NOT NULL AND ticker != ''
+    """).fetchone()
+    con.close()
+    return list(row)
+
+def collect_feed(stream=False, force=False):
+    """Download the feed; the fetch returns a DataFrame or a record count, or None on failure"""
+    return fetch_transaction_data(stream=stream, force=force) is not None
+
+def create_schema():
+    """Create the tables of all four databases"""
+    Path("databases").mkdir(exist_ok=True)
+    results = [create_transactions_tables(), create_stock_prices_tables(),
+               create_representatives_tables(), create_stock_details_tables()]
+    return all(results)
+
+def import_transactions(loader='pandas', force=False):
+    """Import the staged feed and key the other databases by the dimensions"""
+    if not import_initial_data(force=force, loader=loader):
+        return False
+    propagate_dimension_keys()
+    return True
+
+def pipeline_stages(loader='pandas', materialize=False, stream=False, ttl_days=30, force=False):
+    """The pipeline stages: (name, dependencies, run, fingerprint).
+
+    run returns True on success. fingerprint returns a digest of the stage's
+    inputs and outputs, or None if the stage always runs; a stage with the
+    same digest as right after its last successful run is skipped, so one
+    whose outputs were lost or changed since runs again.
+    """
+    return [
+        # The download is conditional on the feed's ETag already
+        ('collect', [], lambda: collect_feed(stream=stream, force=force), None),
+        # Stages whose outputs are missing always run
+        ('schema', [], create_schema, lambda: _digest(
+            _source_fingerprints('setup_database_schema.py', 'dimensions.py', 'pipeline_state.py'),
+        ) if all(Path(path).exists() for path in DATABASES.values()) else None),
+        ('import', ['collect', 'schema'], lambda: import_transactions(loader, force), lambda: _digest(
+            loader, file_fingerprint(LOADERS[loader][0]()),
+            _table_fingerprints(('transactions', 'transactions'), ('representatives', 'representatives')),
+        )),
+        # Market data moves daily, so the fetches also run once per day for unchanged tickers
+        ('prices', ['import'], lambda: fetch_stock_prices(incremental=True), lambda: _digest(
+            _traded_tickers(), date.today(), _table_fingerprints(('prices', 'daily_prices')),
+        )),
+        ('details', ['import'], lambda: fetch_stock_details(ttl_days=ttl_days), lambda: _digest(
+            _traded_tickers(), date.today(), ttl_days, _table_fingerprints(('details', 'stocks')),
+        )),
+        ('compact', ['import', 'prices'], compact_storage, lambda: _digest(
+            _table_fingerprints(('transactions', 'transactions'), ('prices', 'daily_prices')),
+        )),
+        ('views', ['compact', 'details'], lambda: create_dashboard_views(materialize=materialize), lambda: _digest(
+            materialize,
+            _table_fingerprints(('transactions', 'transactions'), ('prices', 'daily_prices'),
+                                ('details', 'stocks')),
+            _source_fingerprints('create_views.py', 'portfolio_valuation.py', 'trade_prices.py'),
+            _relation_types('transactions', [name for name, *_ in DASHBOARD_RELATIONS + DERIVED_VIEWS]),
+            _table_fingerprints(*[('transactions', name) for name, *_ in DERIVED_TABLES]),
+        )),
+        # The snapshot is published after the run, so the export digests what it reads
+        ('export', ['views'], export_parquet, lambda: _digest(
+            _table_fingerprints(('transactions', 'transactions'), ('prices', 'daily_prices'),
+                                ('details', 'stocks'), ('representatives', 'representatives')),
+            load_stage_state().get('views', {}).get('fingerprint'),
+        ) if (Path(EXPORT_DIR) / MANIFEST_NAME).exists() else None),
+    ]
+
+# Stages run when none are selected; the Parquet export is opt-in
+DEFAULT_STAGES = ['collect', 'schema', 'import', 'prices', 'details', 'compact', 'views']
+
+def load_stage_state(path=STAGE_STATE_PATH):
     try:
-        print("Starting pipeline...")
-        
-        # Step 1: Create database schema
-        print("\nCreating database schema...")
-        if not create_database_schema():
-            print("Failed to create database schema. Aborting.")
-            return False
-
-        # Step 2: Fetch data
-        print("\nFetching transaction data...")
-        transactions = fetch_transaction_data()
-        if not transactions:
-            print("Failed to fetch transaction data. Aborting.")
-            return False
-
-        print("\nFetching stock data...")
-        tickers = set(t.get('ticker') for t in transactions if t.get('ticker'))
-        start_date = datetime.now() - timedelta(days=365*2)  # 2 years of data
-        end_date = datetime.now()
-        
-        stock_prices = fetch_stock_prices(tickers, start_date, end_date)
-        stock_details = fetch_stock_details(tickers)
-
-        # Step 3: Validate data
-        print("\nValidating data...")
-        validated_data = validate_all_data(transactions, stock_prices, stock_details)
-
-        # Step 4: Load data into database
-        print("\nLoading data into database...")
-        if not load_data_to_database(validated_data):
-            print("Failed to load data into database. Aborting.")
-            return False
-
-        # Step 5: Create views
-        print("\nCreating database views...")
-        if not create_dashboard_views():
-            print("Failed to create views. Aborting.")
-            return False
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-        print("\nPipeline completed successfully!")
-        return True
+def save_stage_state(state, path=STAGE_STATE_PATH):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path + ".part", "w") as f:
+        json.dump(state, f, indent=4)
+    Path(path + ".part").replace(path)
+
+def downstream(stages, name):
+    """A stage and every stage that depends on it, directly or not"""
+    selected = {name}
+    changed = True
+    while changed:
+        changed = False
+        for stage, dependencies, _, _ in stages:
+            if stage not in selected and selected & set(dependencies):
+                selected.add(stage)
+                changed = True
+    return selected
+
+def select_stages(stages, only=None, start=None, include=None):
+    """Names of the stages to run: --only, --from and the default set, plus `include`"""
+    if only:
+        selected = set(only)
+    elif start:
+        selected = downstream(stages, start) & (set(DEFAULT_STAGES) | set(include or []))
+    else:
+        selected = set(DEFAULT_STAGES)
+    return selected | set(include or [])
+
+def _run_stage(name, run, fingerprint, previous, force):
+    """Run one stage in a worker thread; returns (status, fingerprint, seconds)"""
+    started = time.perf_counter()
+    digest = None
+    if fingerprint is not None:
+        try:
+            digest = fingerprint()
+        except Exception as e:
+            print(f"[{name}] could not fingerprint inputs ({e}), running")
+    if not force and digest is not None and digest == previous:
+        print(f"[{name}] inputs unchanged, skipping")
+        return 'unchanged', digest, time.perf_counter() - started
 
+    print(f"[{name}] starting")
+    try:
+        # Stages return True or False; a bare None also counts as a failure
+        result = run()
+        ok = not (result is False or result is None)
     except Exception as e:
-        print(f"\nError in pipeline: {e}")
-        return False
+        print(f"[{name}] {e}")
+        ok = False
+    if ok and fingerprint is not None:
+        # Digests cover the outputs too, so record them as this run left them
+        try:
+            digest = fingerprint()
+        except Exception as e:
+            print(f"[{name}] could not fingerprint outputs ({e})")
+            digest = None
+    return ('done' if ok else 'failed'), digest, time.perf_counter() - started
+
+def run_pipeline(stages=None, selected=None, force=False, workers=None):
+    """Run the selected stages in dependency order, independent stages concurrently"""
+    stages = stages or pipeline_stages(force=force)
+    by_name = {stage[0]: stage for stage in stages}
+    selected = set(selected or DEFAULT_STAGES)
+    unknown = selected - set(by_name)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    # Dependencies outside the selection are taken as already satisfied
+    waiting = {name: set(by_name[name][1]) & selected for name in selected}
+    state = load_stage_state()
+    results = {}
+    timings = {}
+    started = time.perf_counter()
+    print(f"Running stages: {', '.join(name for name in by_name if name in selected)}")
+
+    # Stages bumping the data version only mark it; the dashboard snapshot is
+    # published once every stage has finished writing
+    with deferred_publish(), ThreadPoolExecutor(max_workers=workers or len(selected)) as pool:
+        running = {}
+        while waiting or running:
+            # Block everything downstream of a failure, not only the direct dependents
+            blocked = True
+            while blocked:
+                blocked = [name for name, dependencies in waiting.items()
+                           if any(results.get(dependency) in ('failed', 'blocked') for dependency in dependencies)]
+                for name in blocked:
+                    del waiting[name]
+                    print(f"[{name}] not run, a dependency failed")
+                    results[name] = 'blocked'
+
+            for name in [name for name, dependencies in waiting.items() if dependencies <= set(results)]:
+                waiting.pop(name)
+                _, _, run, fingerprint = by_name[name]
+                previous = state.get(name, {}).get('fingerprint')
+                running[pool.submit(_run_stage, name, run, fingerprint, previous, force)] = name
+
+            if not running:
+                if waiting:
+                    raise ValueError(f"Dependency cycle between: {', '.join(sorted(waiting))}")
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                status, digest, seconds = future.result()
+                results[name], timings[name] = status, seconds
+                print(f"[{name}] {status} in {seconds:.2f}s")
+                if status == 'done' and digest is not None:
+                    state[name] = {'fingerprint': digest, 'finished_at': datetime.now().isoformat()}
+                    save_stage_state(state)
+
+    elapsed = time.perf_counter() - started
+    print("\nStage        Status      Seconds")
+    for name in by_name:
+        if name in results:
+            print(f"{name:<12} {results[name]:<11} {timings.get(name, 0.0):>7.2f}")
+    print(f"Wall time {elapsed:.2f}s, {sum(timings.values()):.2f}s of stage time")
+
+    if all(status in ('done', 'unchanged') for status in results.values()):
+        print("\nPipeline completed successfully!")
+        return True
+    print("\nPipeline failed")
+    return False
 
 if __name__ == "__main__":
-    run_pipeline() 
\ No newline at end of file
+    stage_names = [stage[0] for stage in pipeline_stages()]
+    parser = argparse.ArgumentParser(description="Run the data pipeline, skipping stages whose inputs are unchanged")
+    parser.add_argument("--only", nargs="+", choices=stage_names, default=None,
+                        help="Only run these stages, assuming their dependencies are done")
+    parser.add_argument("--from", dest="start", choices=stage_names, default=None,
+                        help="Run this stage and every stage downstream of it")
+    parser.add_argument("--force", action="store_true",
+                        help="Run the selected stages even if their inputs are unchanged")
+    parser.add_argument("--export", action="store_true",
+                        help="Also export a Parquet snapshot after the views")
+    parser.add_argument("--loader", choices=sorted(LOADERS), default='pandas',
+                        help="Loader used by the import stage")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the feed to Parquet in the collect stage")
+    parser.add_argument("--materialize", action="store_true",
+                        help="Store the dashboard relations as incrementally refreshed tables")
+    parser.add_argument("--ttl-days", type=int, default=30,
+                        help="Refetch company details older than this many days")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Maximum number of stages running at once")
+    args = parser.parse_args()
+
+    stages = pipeline_stages(loader=args.loader, materialize=args.materialize, stream=args.stream,
+                             ttl_days=args.ttl_days, force=args.force)
+    selected = select_stages(stages, only=args.only, start=args.start,
+                             include=['export'] if args.export else None)
+    run_pipeline(stages, selected, force=args.force, workers=args.workers)
\ No newline at end of file
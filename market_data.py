@@ -0,0 +1,209 @@
+import os
+import json
+import threading
+import argparse
+import duckdb
+import pandas as pd
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+class MarketDataProvider(ABC):
+    """Source of daily prices and company info used by the fetch scripts.
+
+    Subclasses must implement history() and info(); one missing either cannot
+    be instantiated.
+    """
+
+    name = None
+    # Tickers per history() request the backend handles well
+    batch_size = 1
+    # Pause between info() requests the backend expects
+    request_delay = 0.0
+    # Host the requests go to, for the fetch engine's per-host limits
+    host = None
+    # Shared HTTP session, set by the fetch engine for backends that accept one
+    session = None
+
+    @abstractmethod
+    def history(self, tickers, start, end):
+        """Daily OHLCV for each ticker as {ticker: DataFrame indexed by Date}.
+
+        An empty DataFrame means the backend answered with no rows. A ticker
+        whose request failed maps to the exception instead, so one error does
+        not fail the whole batch.
+        """
+
+    @abstractmethod
+    def info(self, ticker):
+        """Company metadata for one ticker as a dict of Yahoo-style keys"""
+
+    @staticmethod
+    def _clean(frame):
+        """Keep the price columns and drop rows where the ticker did not trade"""
+        if frame is None or frame.empty:
+            return pd.DataFrame(columns=PRICE_COLUMNS)
+        frame = frame[[col for col in PRICE_COLUMNS if col in frame.columns]]
+        frame = frame.dropna(how='all')
+        frame.index.name = 'Date'
+        return frame
+
+# yfinance's errors for a range Yahoo answered with no rows, as opposed to a failed request
+EMPTY_ANSWERS = ('no data found', 'no price data found', 'possibly delisted', 'may be delisted')
+
+# yf.download keeps its results and errors in module globals
+_download_lock = threading.Lock()
+
+class YahooProvider(MarketDataProvider):
+    """Yahoo Finance through yfinance.
+
+    yf.download makes one HTTP call per ticker, so batching saves no requests;
+    one ticker per request keeps the rate limiter and timeouts per request.
+    """
+
+    name = 'yahoo'
+    batch_size = 1
+    request_delay = 1.0
+    host = 'query2.finance.yahoo.com'
+
+    def __init__(self):
+        import yfinance as yf
+        self.yf = yf
+
+    @staticmethod
+    def _failure(error):
+        """The exception for a failed request, or None if Yahoo answered with no rows"""
+        text = str(error).lower()
+        if any(answer in text for answer in EMPTY_ANSWERS):
+            return None
+        return error if isinstance(error, Exception) else RuntimeError(str(error))
+
+    def history(self, tickers, start, end):
+        tickers = list(tickers)
+        if len(tickers) == 1:
+            # Errors are raised so throttling and timeouts are retried, not stored as no data
+            try:
+                hist = self.yf.Ticker(tickers[0], session=self.session).history(
+                    start=start, end=end, raise_errors=True
+                )
+            except Exception as e:
+                if self._failure(e):
+                    raise
+                hist = None
+            return {tickers[0]: self._clean(hist)}
+
+        # Adjusted like Ticker.history(); failed tickers come back as empty columns
+        with _download_lock:
+            data = self.yf.download(
+                tickers, start=start, end=end, group_by='ticker',
+                auto_adjust=True, actions=False, threads=False, progress=False,
+                session=self.session
+            )
+            errors = dict(getattr(getattr(self.yf, 'shared', None), '_ERRORS', None) or {})
+        result = {}
+        for ticker in tickers:
+            error = errors.get(ticker.upper(), errors.get(ticker))
+            if error is not None and self._failure(error):
+                result[ticker] = self._failure(error)
+                continue
+            if isinstance(data.columns, pd.MultiIndex):
+                frame = data[ticker] if ticker in data.columns.get_level_values(0) else None
+            else:
+                # Flat columns only describe a single ticker
+                frame = data if len(tickers) == 1 else None
+            result[ticker] = self._clean(frame)
+        return result
+
+    def info(self, ticker):
+        return self.yf.Ticker(ticker, session=self.session).info
+
+class FileProvider(MarketDataProvider):
+    """Offline provider reading fixtures from <root>/prices/<TICKER>.csv and <root>/info/<TICKER>.json"""
+
+    name = 'file'
+    batch_size = 500
+
+    def __init__(self, root=None):
+        self.root = Path(root or os.environ.get('MARKET_DATA_DIR', 'fixtures/market_data'))
+
+    @staticmethod
+    def fixture_name(ticker):
+        """File name stem for a ticker; filings contain symbols like 'BRK/B'"""
+        return ticker.replace('/', '_')
+
+    def history(self, tickers, start, end):
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        result = {}
+        for ticker in tickers:
+            path = self.root / 'prices' / f"{self.fixture_name(ticker)}.csv"
+            if not path.exists():
+                result[ticker] = self._clean(None)
+                continue
+            frame = pd.read_csv(path, parse_dates=['Date'], index_col='Date')
+            frame = frame[(frame.index >= start) & (frame.index < end)]
+            result[ticker] = self._clean(frame)
+        return result
+
+    def info(self, ticker):
+        path = self.root / 'info' / f"{self.fixture_name(ticker)}.json"
+        if not path.exists():
+            raise KeyError(f"No fixture for {ticker}")
+        with open(path) as f:
+            return json.load(f)
+
+PROVIDERS = {
+    'yahoo': YahooProvider,
+    'file': FileProvider,
+}
+
+def get_provider(name=None):
+    """Provider by name (or an existing provider), defaulting to $MARKET_DATA_PROVIDER or Yahoo"""
+    if isinstance(name, MarketDataProvider):
+        return name
+    name = name or os.environ.get('MARKET_DATA_PROVIDER', 'yahoo')
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown market data provider: {name}")
+    return PROVIDERS[name]()
+
+def export_fixtures(root='fixtures/market_data'):
+    """Write the stored prices and stock details as FileProvider fixtures"""
+    root = Path(root)
+    (root / 'prices').mkdir(parents=True, exist_ok=True)
+    (root / 'info').mkdir(parents=True, exist_ok=True)
+
+    con = duckdb.connect('databases/stock_prices.duckdb', read_only=True)
+    prices = con.execute("""
+        SELECT ticker, date as Date, open as Open, high as High, low as Low,
+               close as Close, volume as Volume
+        FROM daily_prices
+        ORDER BY ticker, date
+    """).fetchdf()
+    con.close()
+    for ticker, frame in prices.groupby('ticker'):
+        frame.drop(columns='ticker').to_csv(
+            root / 'prices' / f"{FileProvider.fixture_name(ticker)}.csv", index=False
+        )
+
+    con = duckdb.connect('databases/stock_details.duckdb', read_only=True)
+    details = con.execute("SELECT * FROM stocks").fetchdf()
+    con.close()
+    keys = {
+        'company_name': 'longName', 'sector': 'sector', 'industry': 'industry',
+        'country': 'country', 'market_cap': 'marketCap', 'description': 'longBusinessSummary',
+        'website': 'website', 'exchange': 'exchange', 'currency': 'currency'
+    }
+    for row in details.to_dict('records'):
+        info = {yahoo_key: row[col] for col, yahoo_key in keys.items() if pd.notna(row[col])}
+        with open(root / 'info' / f"{FileProvider.fixture_name(row['ticker'])}.json", "w") as f:
+            json.dump(info, f, indent=4)
+
+    print(f"Exported fixtures for {prices['ticker'].nunique()} price series and "
+          f"{len(details)} stocks to {root}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Market data provider utilities")
+    parser.add_argument("command", choices=['export-fixtures'])
+    parser.add_argument("--root", default='fixtures/market_data', help="Fixture directory")
+    args = parser.parse_args()
+    export_fixtures(args.root)
@@ -0,0 +1,269 @@
+import os
+import time
+import shutil
+import duckdb
+import hashlib
+import argparse
+import threading
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Stamp the pipeline bumps after every load; readers compare it to invalidate caches.
+# A plain file, so it can be read while the databases are open by a writer.
+DATA_VERSION_PATH = "databases/DATA_VERSION"
+
+# Read-only copies of the databases, one directory per data version. DuckDB lets a
+# process write a file only while no other process has it open, so the dashboard
+# reads the latest snapshot and never holds a lock on the files the pipeline writes.
+SNAPSHOT_DIR = "databases/snapshots"
+
+DATABASE_PATHS = [
+    'databases/transactions.duckdb',
+    'databases/stock_prices.duckdb',
+    'databases/stock_details.duckdb',
+    'databases/representatives.duckdb',
+]
+
+# Snapshots kept, the newest included, so a reader can finish switching over;
+# older ones a reader still has open are kept until it lets go
+SNAPSHOTS_KEPT = 2
+
+_publish_lock = threading.Lock()
+_deferred = 0
+_pending = False
+
+def ensure_state_table(con):
+    """Create the key/value table used to remember pipeline state between runs"""
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_state (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR,
+            updated_at TIMESTAMP
+        )
+    """)
+
+def get_state(con, key, default=None):
+    """Read a value from the pipeline_state table"""
+    ensure_state_table(con)
+    row = con.execute("SELECT value FROM pipeline_state WHERE key = ?", [key]).fetchone()
+    return row[0] if row else default
+
+def set_state(con, key, value):
+    """Write a value to the pipeline_state table"""
+    ensure_state_table(con)
+    con.execute("""
+        INSERT OR REPLACE INTO pipeline_state (key, value, updated_at)
+        VALUES (?, ?, current_timestamp)
+    """, [key, None if value is None else str(value)])
+
+def ensure_change_log(con):
+    """Create the table recording which keys a pipeline step changed, and when"""
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            kind VARCHAR,
+            key VARCHAR,
+            changed_at TIMESTAMP
+        )
+    """)
+
+def record_changes(con, kind, keys):
+    """Log that the rows for these keys (e.g. kind 'ticker' or 'representative') changed"""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return
+    ensure_change_log(con)
+    con.register('changed_keys', pd.DataFrame({'key': pd.Series(keys, dtype=object)}))
+    con.execute("""
+        INSERT INTO change_log SELECT ?, key, ? FROM changed_keys
+    """, [kind, datetime.now()])
+    con.unregister('changed_keys')
+
+def changes_since(con, kind, since, table='change_log'):
+    """Keys of a kind changed after `since`, or None if the database keeps no change log"""
+    try:
+        rows = con.execute(f"""
+            SELECT DISTINCT key FROM {table}
+            WHERE kind = ? AND changed_at > ?
+        """, [kind, since]).fetchall()
+    except duckdb.CatalogException:
+        return None
+    return set(row[0] for row in rows)
+
+def trim_change_log(con, before):
+    """Delete the change log entries up to `before`, once a refresh has consumed them"""
+    try:
+        con.execute("DELETE FROM change_log WHERE changed_at <= ?", [before])
+    except duckdb.CatalogException:
+        pass
+
+def file_fingerprint(path, chunk_size=1024 * 1024):
+    """Content hash of a file, or None if it does not exist"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def table_fingerprint(con, table):
+    """Row count and content hash of a table, or None if it does not exist"""
+    columns = [row[0] for row in con.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_catalog = current_database() AND table_schema = 'main' AND table_name = ?
+        ORDER BY ordinal_position
+    """, [table]).fetchall()]
+    if not columns:
+        return None
+    count, content = con.execute(f"""
+        SELECT COUNT(*), CAST(SUM(hash({", ".join(f'"{column}"' for column in columns)})) AS VARCHAR)
+        FROM {table}
+    """).fetchone()
+    return f"{count}:{content}"
+
+def read_data_version(path=DATA_VERSION_PATH):
+    """Current data version stamp, or None if the pipeline has not written one yet"""
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_data_version(path=DATA_VERSION_PATH, version=None):
+    """Write a data version stamp (a new one unless given) and return it"""
+    version = version or str(time.time_ns())
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    # Pipeline stages running concurrently may write at the same time
+    part = f"{path}.{version}.part"
+    with open(part, "w") as f:
+        f.write(version)
+    os.replace(part, path)
+    return version
+
+def _same_file(path, copy):
+    """Whether a snapshot copy still matches the database file it was copied from"""
+    try:
+        source, target = os.stat(path), os.stat(copy)
+    except OSError:
+        return False
+    return source.st_size == target.st_size and source.st_mtime_ns == target.st_mtime_ns
+
+def prune_snapshots(directory=SNAPSHOT_DIR, keep=SNAPSHOTS_KEPT):
+    """Remove all but the newest `keep` snapshots, and staging directories older than them"""
+    versions = sorted((int(entry.name.strip('.').split('.')[0]), entry)
+                      for entry in Path(directory).iterdir()
+                      if entry.is_dir() and entry.name.strip('.').split('.')[0].isdigit())
+    published = [version for version, entry in versions if not entry.name.endswith('.part')]
+    if len(published) <= keep:
+        return
+    oldest_kept = published[-keep]
+    for version, entry in versions:
+        if version >= oldest_kept:
+            continue
+        if not entry.name.endswith('.part') and snapshot_in_use(entry):
+            # A reader still has it open; it goes on a later run
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+
+def snapshot_in_use(snapshot):
+    """Whether a reader still has a database of a snapshot open.
+
+    DuckDB holds a lock on every database file it opens, so a file that
+    cannot be locked exclusively is in use. Files hard-linked into a newer
+    snapshot are skipped: removing this link leaves the data in place. Where
+    file locks cannot be probed (Windows) the snapshot is assumed to be free.
+    """
+    if fcntl is None:
+        return False
+    for path in Path(snapshot).glob('*.duckdb'):
+        if path.stat().st_nlink > 1:
+            continue
+        try:
+            with open(path, 'r+b') as f:
+                fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+    return False
+
+def publish_snapshot(paths=DATABASE_PATHS, directory=SNAPSHOT_DIR, version_path=DATA_VERSION_PATH):
+    """Copy the databases into a new snapshot and point the data version at it.
+
+    Each database is checkpointed first, so its file holds every change. Files
+    unchanged since the previous snapshot are hard-linked instead of copied.
+    Returns the new version, or None if the databases could not be copied.
+    """
+    version = str(time.time_ns())
+    previous = Path(directory) / str(read_data_version(version_path))
+    staging = Path(directory) / f".{version}.part"
+    try:
+        staging.mkdir(parents=True)
+        for path in paths:
+            if not Path(path).exists():
+                continue
+            con = duckdb.connect(path)
+            con.execute("CHECKPOINT")
+            con.close()
+            target = staging / Path(path).name
+            if _same_file(path, previous / Path(path).name):
+                try:
+                    os.link(previous / Path(path).name, target)
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(path, target)
+        os.replace(staging, Path(directory) / version)
+    except Exception as e:
+        print(f"Error publishing snapshot: {e}")
+        shutil.rmtree(staging, ignore_errors=True)
+        return None
+    write_data_version(version_path, version)
+    prune_snapshots(directory)
+    return version
+
+@contextmanager
+def deferred_publish():
+    """Publish one snapshot when the block ends instead of one per bump inside it.
+
+    For pipelines running steps concurrently, where a snapshot taken after one
+    step could copy a database another step is still writing.
+    """
+    global _deferred, _pending
+    with _publish_lock:
+        _deferred += 1
+    try:
+        yield
+    finally:
+        with _publish_lock:
+            _deferred -= 1
+            publish = _deferred == 0 and _pending
+            if publish:
+                _pending = False
+        if publish:
+            publish_snapshot()
+
+def bump_data_version():
+    """Record that the databases changed: publish a snapshot for readers to switch to.
+
+    Call it once the changes are committed and the connections closed.
+    """
+    global _pending
+    with _publish_lock:
+        if _deferred:
+            _pending = True
+            return None
+    return publish_snapshot()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish a snapshot of the databases for the dashboard")
+    parser.parse_args()
+    version = publish_snapshot()
+    if version:
+        print(f"Published data version {version} to {SNAPSHOT_DIR}/{version}")
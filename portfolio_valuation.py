@@ -0,0 +1,167 @@
+import time
+import duckdb
+import argparse
+import pandas as pd
+from setup_database_schema import ESTIMATED_VALUE_SQL
+from pipeline_state import bump_data_version
+
+PORTFOLIO_TABLE = 'portfolio_value_analysis'
+
+# Daily mark-to-market value of every (representative, ticker) position.
+#
+# Each trade is converted to shares at the as-of close on the trade date (or the
+# first close after it), positions are running sums of those share deltas that
+# restart after every full sale, and every trading day from the first trade on
+# is joined as-of to the position in force that day. The work is one pass over
+# trades plus one over (position, trading day) pairs; no per-day loops. Joins and
+# windows run on the integer representative and ticker keys.
+PORTFOLIO_QUERY = """
+    WITH trades AS (
+        SELECT
+            representative_id,
+            ticker_id,
+            representative,
+            ticker,
+            transaction_date,
+            type = 'sale_full' as is_full_sale,
+            CASE WHEN type = 'purchase' THEN 1 ELSE -1 END * {estimated_value} as signed_value
+        FROM transactions
+        WHERE ticker IS NOT NULL AND ticker != ''
+        AND transaction_date IS NOT NULL
+        AND (type = 'purchase' OR type LIKE 'sale%')
+        {representative_filter}
+    ),
+    priced AS (
+        SELECT
+            t.*,
+            COALESCE(pb.close, pa.close) as trade_price
+        FROM trades t
+        ASOF LEFT JOIN prices.daily_prices pb
+            ON t.ticker_id = pb.ticker_id AND t.transaction_date >= pb.date
+        ASOF LEFT JOIN prices.daily_prices pa
+            ON t.ticker_id = pa.ticker_id AND t.transaction_date <= pa.date
+    ),
+    sequenced AS (
+        SELECT
+            *,
+            signed_value / trade_price as share_delta,
+            ROW_NUMBER() OVER (
+                PARTITION BY representative_id, ticker_id
+                ORDER BY transaction_date, is_full_sale, signed_value DESC
+            ) as seq
+        FROM priced
+        WHERE trade_price > 0
+    ),
+    holding_periods AS (
+        SELECT
+            *,
+            -- A full sale closes the position; later trades start a new holding period
+            COALESCE(SUM(is_full_sale::INTEGER) OVER (
+                PARTITION BY representative_id, ticker_id ORDER BY seq
+                ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+            ), 0) as holding_period
+        FROM sequenced
+    ),
+    positions AS (
+        SELECT
+            representative_id,
+            ticker_id,
+            representative,
+            ticker,
+            transaction_date as event_date,
+            CASE WHEN is_full_sale THEN 0
+                 ELSE SUM(share_delta) OVER (
+                     PARTITION BY representative_id, ticker_id, holding_period ORDER BY seq
+                     ROWS UNBOUNDED PRECEDING
+                 )
+            END as shares
+        FROM holding_periods
+        -- The position at the end of each trading day
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY representative_id, ticker_id, transaction_date ORDER BY seq DESC
+        ) = 1
+    ),
+    holders AS (
+        SELECT representative_id, ticker_id, MIN(event_date) as first_date
+        FROM positions
+        GROUP BY representative_id, ticker_id
+    ),
+    holder_days AS (
+        SELECT h.representative_id, h.ticker_id, p.date, p.close
+        FROM holders h
+        JOIN prices.daily_prices p ON p.ticker_id = h.ticker_id AND p.date >= h.first_date
+    )
+    SELECT
+        e.representative,
+        e.ticker,
+        d.date as transaction_date,
+        e.shares,
+        d.close,
+        GREATEST(e.shares, 0) * d.close as stock_value
+    FROM holder_days d
+    ASOF JOIN positions e
+        ON d.representative_id = e.representative_id
+        AND d.ticker_id = e.ticker_id
+        AND d.date >= e.event_date
+    -- Keep the day a position was closed, then nothing until it is reopened
+    WHERE e.shares > 0 OR d.date = e.event_date
+"""
+
+def portfolio_query(representatives=None):
+    """The valuation query, optionally restricted to the representatives in portfolio_reps"""
+    representative_filter = ""
+    if representatives is not None:
+        representative_filter = "AND representative IN (SELECT representative FROM portfolio_reps)"
+    return PORTFOLIO_QUERY.format(estimated_value=ESTIMATED_VALUE_SQL,
+                                  representative_filter=representative_filter)
+
+def build_portfolio_values(con, representatives=None):
+    """Rebuild portfolio_value_analysis, or only the rows of the given representatives.
+
+    Expects the prices database attached as `prices`. Returns the number of
+    rows written.
+    """
+    if representatives is None:
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {PORTFOLIO_TABLE} AS
+            SELECT * FROM ({portfolio_query()})
+            ORDER BY representative, ticker, transaction_date
+        """)
+        con.execute(f"CREATE INDEX idx_{PORTFOLIO_TABLE}_representative ON {PORTFOLIO_TABLE} (representative)")
+        return con.execute(f"SELECT COUNT(*) FROM {PORTFOLIO_TABLE}").fetchone()[0]
+
+    con.register('portfolio_reps', pd.DataFrame({
+        'representative': pd.Series(list(representatives), dtype=object)
+    }))
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"""
+            DELETE FROM {PORTFOLIO_TABLE}
+            WHERE representative IN (SELECT representative FROM portfolio_reps)
+        """)
+        rows = con.execute(f"""
+            INSERT INTO {PORTFOLIO_TABLE}
+            SELECT * FROM ({portfolio_query(representatives)})
+            ORDER BY representative, ticker, transaction_date
+        """).fetchone()[0]
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.unregister('portfolio_reps')
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the daily portfolio valuation table")
+    parser.add_argument("--representative", action="append", default=None,
+                        help="Only revalue this representative (repeatable)")
+    args = parser.parse_args()
+
+    con = duckdb.connect('databases/transactions.duckdb')
+    con.execute("ATTACH 'databases/stock_prices.duckdb' AS prices (READ_ONLY)")
+    started = time.perf_counter()
+    rows = build_portfolio_values(con, args.representative)
+    print(f"Wrote {rows} daily position values in {time.perf_counter() - started:.2f}s")
+    con.close()
+    bump_data_version()
@@ -0,0 +1,175 @@
+import duckdb
+import argparse
+import pandas as pd
+
+# Each fetch job keeps its journal in the database it writes to
+JOURNAL_DATABASES = {
+    'prices': 'databases/stock_prices.duckdb',
+    'details': 'databases/stock_details.duckdb',
+}
+
+class RunJournal:
+    """Durable per-ticker state (pending/done/failed) of a fetch run"""
+
+    def __init__(self, con, job):
+        self.con = con
+        self.job = job
+        self.run_id = None
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS fetch_runs (
+                job VARCHAR,
+                run_id INTEGER,
+                status VARCHAR,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                PRIMARY KEY (job, run_id)
+            )
+        """)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS fetch_journal (
+                job VARCHAR,
+                run_id INTEGER,
+                ticker VARCHAR,
+                state VARCHAR,
+                error VARCHAR,
+                attempts INTEGER,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (job, run_id, ticker)
+            )
+        """)
+
+    def latest_run(self):
+        """(run_id, status) of the most recent run of this job, or None"""
+        return self.con.execute("""
+            SELECT run_id, status FROM fetch_runs
+            WHERE job = ?
+            ORDER BY run_id DESC
+            LIMIT 1
+        """, [self.job]).fetchone()
+
+    def start(self, tickers, new_run=False, retry_failed=False):
+        """Begin or resume a run and return the tickers still to process.
+
+        An interrupted run (status 'running') is resumed: its pending and failed
+        tickers are processed again. With retry_failed, a finished run is reopened
+        for its failed tickers only. Otherwise a new run covering all tickers starts.
+        """
+        latest = self.latest_run()
+        resume = latest and not new_run and (latest[1] == 'running' or
+                                              (retry_failed and latest[1] == 'failed'))
+
+        if resume:
+            self.run_id = latest[0]
+            self.con.execute("""
+                UPDATE fetch_journal SET state = 'pending', updated_at = current_timestamp
+                WHERE job = ? AND run_id = ? AND state = 'failed'
+            """, [self.job, self.run_id])
+            self.con.execute("""
+                UPDATE fetch_runs SET status = 'running', finished_at = NULL
+                WHERE job = ? AND run_id = ?
+            """, [self.job, self.run_id])
+            remaining = [row[0] for row in self.con.execute("""
+                SELECT ticker FROM fetch_journal
+                WHERE job = ? AND run_id = ? AND state = 'pending'
+                ORDER BY ticker
+            """, [self.job, self.run_id]).fetchall()]
+            print(f"Resuming {self.job} run {self.run_id}: {len(remaining)} tickers left")
+            return remaining
+
+        self.run_id = (latest[0] + 1) if latest else 1
+        self.con.execute("""
+            INSERT INTO fetch_runs VALUES (?, ?, 'running', current_timestamp, NULL)
+        """, [self.job, self.run_id])
+        self.con.register('journal_tickers', pd.DataFrame({'ticker': list(tickers)}))
+        self.con.execute("""
+            INSERT INTO fetch_journal
+            SELECT ?, ?, ticker, 'pending', NULL, 0, current_timestamp
+            FROM journal_tickers
+        """, [self.job, self.run_id])
+        self.con.unregister('journal_tickers')
+        print(f"Started {self.job} run {self.run_id} for {len(tickers)} tickers")
+        return list(tickers)
+
+    def mark_done(self, ticker):
+        """Record a ticker as finished, unless another part of it already failed"""
+        self.con.execute("""
+            UPDATE fetch_journal
+            SET state = 'done', attempts = attempts + 1, updated_at = current_timestamp
+            WHERE job = ? AND run_id = ? AND ticker = ? AND state != 'failed'
+        """, [self.job, self.run_id, ticker])
+
+    def mark_failed(self, ticker, error):
+        """Record a ticker as failed with its error"""
+        self.con.execute("""
+            UPDATE fetch_journal
+            SET state = 'failed', error = ?, attempts = attempts + 1, updated_at = current_timestamp
+            WHERE job = ? AND run_id = ? AND ticker = ?
+        """, [str(error), self.job, self.run_id, ticker])
+
+    def finish(self):
+        """Close the run as 'complete', or 'failed' if any ticker failed"""
+        failed = self.con.execute("""
+            SELECT COUNT(*) FROM fetch_journal
+            WHERE job = ? AND run_id = ? AND state != 'done'
+        """, [self.job, self.run_id]).fetchone()[0]
+        status = 'failed' if failed else 'complete'
+        self.con.execute("""
+            UPDATE fetch_runs SET status = ?, finished_at = current_timestamp
+            WHERE job = ? AND run_id = ?
+        """, [status, self.job, self.run_id])
+        return status
+
+def print_run_summary(job, database=None, max_errors=20):
+    """Print the state of the latest run of a job"""
+    try:
+        con = duckdb.connect(database or JOURNAL_DATABASES[job], read_only=True)
+    except Exception as e:
+        print(f"{job}: cannot open journal ({e})")
+        return
+    try:
+        run = con.execute("""
+            SELECT run_id, status, started_at, finished_at FROM fetch_runs
+            WHERE job = ?
+            ORDER BY run_id DESC
+            LIMIT 1
+        """, [job]).fetchone()
+    except duckdb.CatalogException:
+        run = None
+    if not run:
+        print(f"{job}: no runs recorded")
+        con.close()
+        return
+
+    run_id, status, started_at, finished_at = run
+    counts = dict(con.execute("""
+        SELECT state, COUNT(*) FROM fetch_journal
+        WHERE job = ? AND run_id = ?
+        GROUP BY state
+    """, [job, run_id]).fetchall())
+    print(f"{job}: run {run_id} {status} (started {started_at}, finished {finished_at or '-'})")
+    print(f"  pending: {counts.get('pending', 0)}, done: {counts.get('done', 0)}, "
+          f"failed: {counts.get('failed', 0)}")
+
+    failures = con.execute("""
+        SELECT ticker, error FROM fetch_journal
+        WHERE job = ? AND run_id = ? AND state = 'failed'
+        ORDER BY ticker
+        LIMIT ?
+    """, [job, run_id, max_errors]).fetchall()
+    for ticker, error in failures:
+        print(f"    {ticker}: {error}")
+    if counts.get('failed', 0) > len(failures):
+        print(f"    ... and {counts['failed'] - len(failures)} more")
+    con.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect fetch run journals")
+    parser.add_argument("command", choices=['status'])
+    parser.add_argument("--job", choices=sorted(JOURNAL_DATABASES), default=None,
+                        help="Only show this job (default: all)")
+    args = parser.parse_args()
+    for job in ([args.job] if args.job else sorted(JOURNAL_DATABASES)):
+        print_run_summary(job)
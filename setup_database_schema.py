@@ -1,8 +1,43 @@
+import re
 import duckdb
+import argparse
 import pandas as pd
 from pathlib import Path
+from collect_data import TRANSACTION_COLUMNS
+from pipeline_state import (
+    ensure_state_table, ensure_change_log, get_state, set_state, file_fingerprint, bump_data_version,
+    record_changes
+)
+from dimensions import (
+    ensure_dimensions, sync_dimensions, assign_transaction_keys, refresh_representative_attributes,
+    propagate_ticker_ids
+)
 
-def setup_database_schema():
+DATE_FORMATS = ['%m/%d/%Y', '%Y-%m-%d', '%m-%d-%Y']
+
+BOOLEAN_VALUES = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}
+
+# Columns that identify a single filed transaction; everything else may be amended
+TRANSACTION_KEY_COLUMNS = [
+    'ptr_link', 'representative', 'transaction_date', 'ticker',
+    'asset_description', 'owner', 'type'
+]
+
+# Dollar value assumed for a filed amount range, as an SQL expression over the parsed bounds
+ESTIMATED_VALUE_SQL = "COALESCE(amount_mid, 0)"
+
+# Numeric bounds parsed from the `amount` range label at load time
+AMOUNT_COLUMNS = ['amount_low', 'amount_high', 'amount_mid']
+
+AMOUNT_NUMBER = re.compile(r'\d[\d,]*(?:\.\d+)?')
+
+# Integer keys of transactions into representative_dim and ticker_dim
+KEY_COLUMNS = ['representative_id', 'ticker_id']
+
+# Low-cardinality columns stored as ENUMs; their value lists grow with the feed
+ENUM_COLUMNS = ['type', 'party', 'owner', 'state']
+
+def setup_database_schema(loader='pandas'):
     """Set up properly modeled database schema"""
     try:
         print("Setting up database schema...")
@@ -21,42 +56,33 @@ def setup_database_schema():
         
         # Step 2: Import initial data
         print("\nImporting data into databases...")
-        if not import_initial_data():
+        if not import_initial_data(loader=loader):
             return False
         
+        # Step 3: Key prices, details and representatives by the dimensions
+        propagate_dimension_keys()
+        
         return True
         
     except Exception as e:
         print(f"Error setting up database schema: {e}")
         return False
 
+def propagate_dimension_keys():
+    """Copy the ticker keys to prices and details and rebuild representatives from the dimension"""
+    con_trans = duckdb.connect('databases/transactions.duckdb')
+    propagate_ticker_ids(con_trans)
+    con_rep = duckdb.connect('databases/representatives.duckdb')
+    refresh_representatives(con_trans, con_rep)
+    con_rep.close()
+    con_trans.close()
+
 def create_transactions_tables():
     """Create tables in transactions database"""
     try:
         print("\nSetting up transactions database...")
         con = duckdb.connect('databases/transactions.duckdb')
-        
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS transactions (
-                disclosure_year INTEGER,
-                disclosure_date DATE,
-                transaction_date DATE,
-                owner VARCHAR,
-                ticker VARCHAR,
-                asset_description VARCHAR,
-                type VARCHAR,
-                amount VARCHAR,
-                representative VARCHAR,
-                district VARCHAR,
-                state VARCHAR,
-                ptr_link VARCHAR,
-                cap_gains_over_200_usd BOOLEAN,
-                industry VARCHAR,
-                sector VARCHAR,
-                party VARCHAR
-            )
-        """)
-        
+        create_transactions_schema(con)
         con.close()
         print("Transactions database setup complete")
         return True
@@ -64,6 +90,140 @@ def create_transactions_tables():
         print(f"Error setting up transactions database: {e}")
         return False
 
+def create_transactions_schema(con):
+    """Create the transactions table on an open connection"""
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            disclosure_year INTEGER,
+            disclosure_date DATE,
+            transaction_date DATE,
+            owner VARCHAR,
+            ticker VARCHAR,
+            asset_description VARCHAR,
+            type VARCHAR,
+            amount VARCHAR,
+            representative VARCHAR,
+            district VARCHAR,
+            state VARCHAR,
+            ptr_link VARCHAR,
+            cap_gains_over_200_usd BOOLEAN,
+            industry VARCHAR,
+            sector VARCHAR,
+            party VARCHAR,
+            row_key VARCHAR,
+            row_hash VARCHAR,
+            amount_low DOUBLE,
+            amount_high DOUBLE,
+            amount_mid DOUBLE,
+            representative_id INTEGER,
+            ticker_id INTEGER
+        )
+    """)
+    
+    # Databases created before delta loading lack the key columns, and older
+    # ones the parsed amounts and dimension keys, which are filled in once here
+    columns = _column_types(con, 'transactions')
+    con.execute("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS row_key VARCHAR")
+    con.execute("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS row_hash VARCHAR")
+    for col in AMOUNT_COLUMNS:
+        con.execute(f"ALTER TABLE transactions ADD COLUMN IF NOT EXISTS {col} DOUBLE")
+    for col in KEY_COLUMNS:
+        con.execute(f"ALTER TABLE transactions ADD COLUMN IF NOT EXISTS {col} INTEGER")
+    if 'amount_mid' not in columns:
+        con.register('amount_bounds', amount_bounds(con, 'transactions'))
+        con.execute(f"""
+            UPDATE transactions
+            SET {", ".join(f"{col} = b.{col}" for col in AMOUNT_COLUMNS)}
+            FROM amount_bounds b
+            WHERE b.label = transactions.amount
+        """)
+        con.unregister('amount_bounds')
+    ensure_dimensions(con)
+    if 'ticker_id' not in columns:
+        assign_transaction_keys(con)
+        refresh_representative_attributes(con)
+    sync_enum_columns(con)
+    ensure_state_table(con)
+    ensure_change_log(con)
+
+def _column_types(con, table):
+    """Column name -> data type of a table in the main database"""
+    return dict(con.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_catalog = current_database() AND table_schema = 'main' AND table_name = ?
+    """, [table]).fetchall())
+
+def parse_amount(label):
+    """(low, high, mid) dollars of a filed amount range label, or None if unrecognized.
+
+    '$1,001 - $15,000' gives (1001, 15000, 8000) and '< $1,000' gives
+    (0, 1000, 500). Open ranges such as '> $5,000,000' have no upper bound
+    and use the lower bound as their midpoint.
+    """
+    text = label.strip().lower()
+    numbers = [float(number.replace(',', '')) for number in AMOUNT_NUMBER.findall(text)]
+    if len(numbers) == 2 and numbers[0] <= numbers[1]:
+        low, high = numbers
+    elif len(numbers) == 1 and text.startswith(('<', 'under', 'less than')):
+        low, high = 0.0, numbers[0]
+    elif len(numbers) == 1 and (text.startswith(('>', 'over', 'more than')) or text.endswith('+')):
+        return numbers[0], None, numbers[0]
+    elif len(numbers) == 1 and '-' not in text:
+        low = high = numbers[0]
+    else:
+        return None
+    return low, high, float((low + high) // 2)
+
+def amount_bounds(con, source):
+    """Parse each distinct amount label of `source` once; logs the labels that did not parse"""
+    bounds = []
+    unrecognized = []
+    for label, count in con.execute(f"""
+        SELECT amount, COUNT(*) FROM {source}
+        WHERE amount IS NOT NULL
+        GROUP BY amount
+    """).fetchall():
+        parsed = parse_amount(label)
+        if parsed is None:
+            unrecognized.append((label, count))
+            parsed = (None, None, None)
+        bounds.append((label, *parsed))
+    
+    if unrecognized:
+        print(f"Unrecognized amount formats in {sum(count for _, count in unrecognized)} rows:")
+        for label, count in sorted(unrecognized, key=lambda item: -item[1]):
+            print(f"  {label!r}: {count}")
+    return pd.DataFrame(bounds, columns=['label'] + AMOUNT_COLUMNS).astype(
+        {col: 'float64' for col in AMOUNT_COLUMNS}
+    )
+
+def sync_enum_columns(con, source=None):
+    """Store ENUM_COLUMNS of transactions as ENUMs covering every value in it and in `source`.
+
+    A column is retyped when it is not an ENUM yet or a new value appears.
+    Value lists are kept sorted so MIN/MAX order like the strings. Returns
+    True if any column was retyped.
+    """
+    types = _column_types(con, 'transactions')
+    retyped = False
+    for col in ENUM_COLUMNS:
+        current = set()
+        if types[col].startswith('ENUM'):
+            current = set(con.execute(f"SELECT enum_range(ANY_VALUE({col})) FROM transactions").fetchone()[0])
+        
+        sources = ['transactions'] + ([source] if source else [])
+        values = set(row[0] for row in con.execute(" UNION ".join(
+            f"SELECT DISTINCT CAST({col} AS VARCHAR) FROM {table} WHERE {col} IS NOT NULL"
+            for table in sources
+        )).fetchall()) | current
+        if not values or (values == current and types[col].startswith('ENUM')):
+            continue
+        
+        labels = ", ".join("'" + value.replace("'", "''") + "'" for value in sorted(values))
+        con.execute(f"ALTER TABLE transactions ALTER {col} SET DATA TYPE ENUM({labels})")
+        retyped = True
+    return retyped
+
 def create_stock_prices_tables():
     """Create tables in stock prices database"""
     try:
@@ -79,9 +239,12 @@ def create_stock_prices_tables():
                 low DOUBLE,
                 close DOUBLE,
                 volume BIGINT,
+                ticker_id INTEGER,
                 PRIMARY KEY (ticker, date)
             )
         """)
+        con.execute("ALTER TABLE daily_prices ADD COLUMN IF NOT EXISTS ticker_id INTEGER")
+        ensure_change_log(con)
         
         con.close()
         print("Stock prices database setup complete")
@@ -108,9 +271,12 @@ def create_stock_details_tables():
                 website VARCHAR,
                 exchange VARCHAR,
                 currency VARCHAR,
-                last_updated_date DATE
+                last_updated_date DATE,
+                ticker_id INTEGER
             )
         """)
+        con.execute("ALTER TABLE stocks ADD COLUMN IF NOT EXISTS ticker_id INTEGER")
+        ensure_change_log(con)
         
         con.close()
         print("Stock details database setup complete")
@@ -142,75 +308,377 @@ def create_representatives_tables():
         print(f"Error setting up representatives database: {e}")
         return False
 
-def import_initial_data():
+def staged_feed_path():
+    """Path of the newest staged copy of the feed (Parquet or CSV)"""
+    parquet_path = Path("data/all_transactions.parquet")
+    csv_path = Path("data/all_transactions.csv")
+    if parquet_path.exists() and (not csv_path.exists() or
+                                  parquet_path.stat().st_mtime >= csv_path.stat().st_mtime):
+        return parquet_path
+    return csv_path
+
+def load_transactions_frame(path=None):
+    """Load the staged feed, preferring whichever of the Parquet/CSV copies is newest"""
+    path = Path(path) if path else staged_feed_path()
+    if path.suffix == '.parquet':
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def normalize_dates(series, formats=DATE_FORMATS):
+    """Parse a date column against each supported format in turn, whole column at a time"""
+    values = series.astype('string').str.strip()
+    parsed = pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]')
+    counts = {}
+    for fmt in formats:
+        remaining = parsed.isna() & values.notna()
+        if not remaining.any():
+            counts[fmt] = 0
+            continue
+        attempt = pd.to_datetime(values[remaining], format=fmt, errors='coerce')
+        # Typos like '0009-06-07' fall outside the nanosecond range and count as unparseable
+        attempt = attempt.where(attempt.between(pd.Timestamp.min, pd.Timestamp.max))
+        attempt = attempt.astype('datetime64[ns]')
+        counts[fmt] = int(attempt.notna().sum())
+        parsed[remaining] = attempt
+    counts['unparseable'] = int((parsed.isna() & values.notna()).sum())
+    counts['missing'] = int(values.isna().sum())
+    return parsed, counts
+
+def normalize_integers(series):
+    """Convert a column to integers, with 0 for missing or unparseable values"""
+    numeric = pd.to_numeric(series, errors='coerce')
+    counts = {
+        'parsed': int(numeric.notna().sum()),
+        'unparseable': int((numeric.isna() & series.notna()).sum()),
+        'missing': int(series.isna().sum())
+    }
+    return numeric.fillna(0).astype(int), counts
+
+def normalize_booleans(series):
+    """Convert a column of boolean-ish values to bool, with False for missing or unknown values"""
+    lowered = series.astype('string').str.strip().str.lower()
+    mapped = lowered.map(BOOLEAN_VALUES)
+    counts = {
+        'true': int(mapped.eq(True).sum()),
+        'false': int(mapped.eq(False).sum()),
+        'unparseable': int((mapped.isna() & lowered.notna()).sum()),
+        'missing': int(lowered.isna().sum())
+    }
+    return mapped.fillna(False).astype(bool), counts
+
+def normalize_transactions(df):
+    """Vectorized type normalization of the raw feed; returns the frame and per-column stats"""
+    report = {}
+    for col in ['disclosure_date', 'transaction_date']:
+        df[col], report[col] = normalize_dates(df[col])
+    df['disclosure_year'], report['disclosure_year'] = normalize_integers(df['disclosure_year'])
+    df['cap_gains_over_200_usd'], report['cap_gains_over_200_usd'] = \
+        normalize_booleans(df['cap_gains_over_200_usd'])
+    
+    # Blank strings are treated as missing, like the CSV round trip always did
+    text_columns = [col for col in TRANSACTION_COLUMNS if col in df.columns and col not in report]
+    df[text_columns] = df[text_columns].replace(r'^\s*$', None, regex=True)
+    return df, report
+
+def print_normalization_report(report):
+    """Print how many rows fell to each format or could not be parsed"""
+    for col, counts in report.items():
+        summary = ", ".join(f"{name}: {count}" for name, count in counts.items())
+        print(f"  {col}: {summary}")
+
+def _hash_expr(columns):
+    """SQL expression hashing the given columns, NULL-safe"""
+    parts = ", ".join(f"COALESCE(CAST({col} AS VARCHAR), '<null>')" for col in columns)
+    return f"md5(concat_ws('|', {parts}))"
+
+def merge_staged_transactions(con):
+    """Apply the temp table staged_transactions to transactions as a delta.
+
+    Each staged row gets a row_key (hash of the columns identifying the filed
+    transaction, disambiguated for exact duplicates) and a row_hash (hash of all
+    columns). Only rows that are new, amended or removed are written.
+    """
+    key_expr = _hash_expr(TRANSACTION_KEY_COLUMNS)
+    content_expr = _hash_expr(TRANSACTION_COLUMNS)
+    key_cols = ", ".join(TRANSACTION_KEY_COLUMNS)
+    columns = ", ".join(TRANSACTION_COLUMNS)
+
+    amount_cols = ", ".join(AMOUNT_COLUMNS)
+
+    con.register('amount_bounds', amount_bounds(con, 'staged_transactions'))
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE staged_keyed AS
+        SELECT
+            {columns},
+            md5({key_expr} || '#' || CAST(ROW_NUMBER() OVER (
+                PARTITION BY {key_cols} ORDER BY {content_expr}
+            ) AS VARCHAR)) as row_key,
+            {content_expr} as row_hash,
+            {", ".join(f"b.{col}" for col in AMOUNT_COLUMNS)}
+        FROM staged_transactions
+        LEFT JOIN amount_bounds b ON b.label = amount
+    """)
+    con.unregister('amount_bounds')
+
+    new, amended, removed = con.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM staged_keyed s
+             WHERE NOT EXISTS (SELECT 1 FROM transactions t WHERE t.row_key = s.row_key)),
+            (SELECT COUNT(*) FROM staged_keyed s
+             JOIN transactions t ON t.row_key = s.row_key
+             WHERE t.row_hash != s.row_hash),
+            (SELECT COUNT(*) FROM transactions t
+             WHERE t.row_key IS NULL
+             OR NOT EXISTS (SELECT 1 FROM staged_keyed s WHERE s.row_key = t.row_key))
+    """).fetchone()
+
+    if new or amended or removed:
+        # New categorical values widen the ENUM types. Stored dashboard tables hold
+        # copies of the old types, so the next refresh has to rebuild them in full.
+        if sync_enum_columns(con, 'staged_keyed'):
+            set_state(con, 'dashboard_refreshed_at', None)
+
+        # Representatives and tickers of every row about to be removed or written,
+        # so downstream tables can refresh just those partitions
+        changed = con.execute("""
+            SELECT representative, ticker FROM transactions t
+            WHERE row_key IS NULL
+            OR NOT EXISTS (
+                SELECT 1 FROM staged_keyed s
+                WHERE s.row_key = t.row_key AND s.row_hash = t.row_hash
+            )
+            UNION
+            SELECT representative, ticker FROM staged_keyed s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM transactions t
+                WHERE t.row_key = s.row_key AND t.row_hash = s.row_hash
+            )
+        """).fetchall()
+        con.execute("BEGIN TRANSACTION")
+        try:
+            sync_dimensions(con, 'staged_keyed')
+            record_changes(con, 'representative', [rep for rep, _ in changed])
+            record_changes(con, 'ticker', [ticker for _, ticker in changed])
+            # Drop removed and amended rows, then insert everything not already present
+            con.execute("""
+                DELETE FROM transactions
+                WHERE row_key IS NULL
+                OR NOT EXISTS (
+                    SELECT 1 FROM staged_keyed s
+                    WHERE s.row_key = transactions.row_key
+                    AND s.row_hash = transactions.row_hash
+                )
+            """)
+            con.execute(f"""
+                INSERT INTO transactions ({columns}, row_key, row_hash, {amount_cols}, {", ".join(KEY_COLUMNS)})
+                SELECT {", ".join(f"s.{col}" for col in TRANSACTION_COLUMNS)}, s.row_key, s.row_hash,
+                    {", ".join(f"s.{col}" for col in AMOUNT_COLUMNS)}, r.representative_id, k.ticker_id
+                FROM staged_keyed s
+                LEFT JOIN representative_dim r ON r.representative = s.representative
+                LEFT JOIN ticker_dim k ON k.ticker = s.ticker
+                WHERE NOT EXISTS (SELECT 1 FROM transactions t WHERE t.row_key = s.row_key)
+            """)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+    con.execute("DROP TABLE IF EXISTS staged_keyed")
+    return {'new': new, 'amended': amended, 'removed': removed}
+
+def refresh_representatives(con_trans, con_rep):
+    """Rebuild the representatives table from the representative dimension, one row per person"""
+    refresh_representative_attributes(con_trans)
+    rep_df = con_trans.execute("""
+        SELECT representative_id, representative, district, state, party
+        FROM representative_dim
+        WHERE representative_id IN (SELECT representative_id FROM transactions)
+    """).fetchdf()
+    
+    con_rep.execute("DELETE FROM representatives")
+    con_rep.register('rep_df', rep_df)
+    con_rep.execute("""
+        INSERT INTO representatives (representative_id, name, district, state, party)
+        SELECT representative_id, representative, district, state, party
+        FROM rep_df
+    """)
+
+def native_feed_path():
+    """Path of the newest raw copy of the feed DuckDB can read directly (Parquet or JSON)"""
+    parquet_path = Path("data/all_transactions.parquet")
+    json_path = Path("data/all_transactions.json")
+    if parquet_path.exists() and (not json_path.exists() or
+                                  parquet_path.stat().st_mtime >= json_path.stat().st_mtime):
+        return parquet_path
+    return json_path
+
+def create_staging_table(con):
+    """Empty temp table with the transactions column types, ENUMs staged as VARCHAR"""
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE staged_transactions AS
+        SELECT * EXCLUDE (row_key, row_hash, {", ".join(AMOUNT_COLUMNS + KEY_COLUMNS)})
+            REPLACE ({", ".join(f"CAST({col} AS VARCHAR) as {col}" for col in ENUM_COLUMNS)})
+        FROM transactions LIMIT 0
+    """)
+
+def stage_transactions_pandas(con, source):
+    """Stage the feed through pandas: read, normalize and insert into staged_transactions"""
+    print("Loading transaction data...")
+    df = load_transactions_frame(source)
+    
+    # Normalize dates, years and flags column-at-a-time
+    print("Normalizing columns...")
+    df, report = normalize_transactions(df)
+    print_normalization_report(report)
+    
+    # Fill NaN values with None for proper SQL handling
+    df = df.replace({pd.NA: None})
+    
+    create_staging_table(con)
+    con.register('df', df.reindex(columns=TRANSACTION_COLUMNS))
+    con.execute(f"""
+        INSERT INTO staged_transactions
+        SELECT {", ".join(TRANSACTION_COLUMNS)} FROM df
+    """)
+    con.unregister('df')
+
+def _feed_reader_sql(source):
+    """DuckDB table function reading the raw feed with every column as VARCHAR"""
+    source = Path(source)
+    if source.suffix == '.parquet':
+        return f"read_parquet('{source.as_posix()}')"
+    if source.suffix == '.csv':
+        return f"read_csv('{source.as_posix()}', header=true, all_varchar=true)"
+    columns = ", ".join(f"'{col}': 'VARCHAR'" for col in TRANSACTION_COLUMNS)
+    return f"read_json('{source.as_posix()}', format='array', columns={{{columns}}})"
+
+def _sql_text(col):
+    """Blank strings are treated as missing, as in the pandas path"""
+    return f"CASE WHEN trim(CAST({col} AS VARCHAR)) = '' THEN NULL ELSE CAST({col} AS VARCHAR) END"
+
+def _sql_date_attempts(col):
+    """One expression per DATE_FORMATS entry, NULL unless it parses to a representable date"""
+    low = pd.Timestamp.min.ceil('D').strftime('%Y-%m-%d')
+    high = pd.Timestamp.max.floor('D').strftime('%Y-%m-%d')
+    attempts = []
+    for fmt in DATE_FORMATS:
+        parsed = f"try_strptime(trim(CAST({col} AS VARCHAR)), '{fmt}')"
+        attempts.append(
+            f"CASE WHEN {parsed} BETWEEN TIMESTAMP '{low}' AND TIMESTAMP '{high}' "
+            f"THEN CAST({parsed} AS DATE) END"
+        )
+    return attempts
+
+def _sql_boolean(col):
+    cases = " ".join(f"WHEN '{k}' THEN {str(v).lower()}" for k, v in BOOLEAN_VALUES.items())
+    return f"CASE lower(trim(CAST({col} AS VARCHAR))) {cases} END"
+
+def _sql_integer(col):
+    return f"TRY_CAST(TRY_CAST(trim(CAST({col} AS VARCHAR)) AS DOUBLE) AS INTEGER)"
+
+def native_normalization_report(con, reader):
+    """Same per-column counts as normalize_transactions, computed inside DuckDB"""
+    selects = []
+    labels = []
+    for col in ['disclosure_date', 'transaction_date']:
+        attempts = _sql_date_attempts(col)
+        for i, fmt in enumerate(DATE_FORMATS):
+            earlier = "".join(f" AND {a} IS NULL" for a in attempts[:i])
+            selects.append(f"COUNT(*) FILTER (WHERE {attempts[i]} IS NOT NULL{earlier})")
+            labels.append((col, fmt))
+        selects.append(f"COUNT(*) FILTER (WHERE {_sql_text(col)} IS NOT NULL AND COALESCE({', '.join(attempts)}) IS NULL)")
+        labels.append((col, 'unparseable'))
+        selects.append(f"COUNT(*) FILTER (WHERE {_sql_text(col)} IS NULL)")
+        labels.append((col, 'missing'))
+    
+    year = _sql_integer('disclosure_year')
+    selects += [
+        f"COUNT(*) FILTER (WHERE {year} IS NOT NULL)",
+        f"COUNT(*) FILTER (WHERE {year} IS NULL AND disclosure_year IS NOT NULL)",
+        "COUNT(*) FILTER (WHERE disclosure_year IS NULL)"
+    ]
+    labels += [('disclosure_year', 'parsed'), ('disclosure_year', 'unparseable'),
+               ('disclosure_year', 'missing')]
+    
+    flag = _sql_boolean('cap_gains_over_200_usd')
+    selects += [
+        f"COUNT(*) FILTER (WHERE {flag})",
+        f"COUNT(*) FILTER (WHERE NOT {flag})",
+        f"COUNT(*) FILTER (WHERE {flag} IS NULL AND cap_gains_over_200_usd IS NOT NULL)",
+        "COUNT(*) FILTER (WHERE cap_gains_over_200_usd IS NULL)"
+    ]
+    labels += [('cap_gains_over_200_usd', 'true'), ('cap_gains_over_200_usd', 'false'),
+               ('cap_gains_over_200_usd', 'unparseable'), ('cap_gains_over_200_usd', 'missing')]
+    
+    counts = con.execute(f"SELECT {', '.join(selects)} FROM {reader}").fetchone()
+    report = {}
+    for (col, label), count in zip(labels, counts):
+        report.setdefault(col, {})[label] = count
+    return report
+
+def stage_transactions_duckdb(con, source):
+    """Stage the raw feed with DuckDB's own readers, doing the cleanup in SQL"""
+    print(f"Loading transaction data from {source} with DuckDB...")
+    reader = _feed_reader_sql(source)
+    
+    print("Normalizing columns...")
+    print_normalization_report(native_normalization_report(con, reader))
+    
+    expressions = []
+    for col in TRANSACTION_COLUMNS:
+        if col in ('disclosure_date', 'transaction_date'):
+            expr = f"COALESCE({', '.join(_sql_date_attempts(col))})"
+        elif col == 'disclosure_year':
+            expr = f"COALESCE({_sql_integer(col)}, 0)"
+        elif col == 'cap_gains_over_200_usd':
+            expr = f"COALESCE({_sql_boolean(col)}, false)"
+        else:
+            expr = _sql_text(col)
+        expressions.append(f"{expr} as {col}")
+    
+    create_staging_table(con)
+    con.execute(f"""
+        INSERT INTO staged_transactions
+        SELECT {", ".join(expressions)}
+        FROM {reader}
+    """)
+
+# Each loader: (function picking the source file, function staging it)
+LOADERS = {
+    'pandas': (staged_feed_path, stage_transactions_pandas),
+    'duckdb': (native_feed_path, stage_transactions_duckdb),
+}
+
+def import_initial_data(force=False, loader='pandas'):
     """Import data from CSV into appropriate databases"""
     try:
-        print("Loading transaction data...")
-        df = pd.read_csv("data/all_transactions.csv")
-        
-        # Convert date columns to proper format
-        print("Converting date formats...")
-        
-        # Function to safely convert dates
-        def convert_date(date_str):
-            try:
-                # Try parsing with multiple formats
-                for fmt in ['%m/%d/%Y', '%Y-%m-%d', '%m-%d-%Y']:
-                    try:
-                        return pd.to_datetime(date_str, format=fmt).strftime('%Y-%m-%d')
-                    except:
-                        continue
-                # If all formats fail, return None
-                return None
-            except:
-                return None
+        find_source, stage = LOADERS[loader]
+        source = find_source()
+        fingerprint = file_fingerprint(source)
         
-        # Convert date columns
-        date_columns = ['disclosure_date', 'transaction_date']
-        for col in date_columns:
-            df[col] = df[col].apply(convert_date)
-            # Fill invalid dates with None
-            df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y-%m-%d')
-        
-        # Convert disclosure_year to integer
-        df['disclosure_year'] = pd.to_numeric(df['disclosure_year'], errors='coerce').fillna(0).astype(int)
-        
-        # Convert boolean column
-        df['cap_gains_over_200_usd'] = df['cap_gains_over_200_usd'].fillna(False)
-        
-        # Fill NaN values with None for proper SQL handling
-        df = df.replace({pd.NA: None})
-        
-        # Connect to databases
         con_trans = duckdb.connect('databases/transactions.duckdb')
-        con_rep = duckdb.connect('databases/representatives.duckdb')
+        if not force and fingerprint and get_state(con_trans, 'transactions_source_hash') == fingerprint:
+            print(f"{source} unchanged since last import, nothing to do")
+            con_trans.close()
+            return True
         
-        # Import transactions
+        # Stage the feed with the table's column types, then apply only the delta
+        stage(con_trans, source)
         print("Importing transactions...")
-        con_trans.execute("DELETE FROM transactions")
-        con_trans.register('df', df)
-        con_trans.execute("""
-            INSERT INTO transactions 
-            SELECT * FROM df
-        """)
-        
-        # Extract unique representatives
-        print("Extracting representative information...")
-        rep_df = df[['representative', 'district', 'state', 'party']].drop_duplicates()
-        rep_df['representative_id'] = range(1, len(rep_df) + 1)
+        changes = merge_staged_transactions(con_trans)
+        print(f"New: {changes['new']}, amended: {changes['amended']}, removed: {changes['removed']}")
         
-        # Import representatives
-        print("Importing representatives...")
-        con_rep.execute("DELETE FROM representatives")
-        con_rep.register('rep_df', rep_df)
-        con_rep.execute("""
-            INSERT INTO representatives (representative_id, name, district, state, party)
-            SELECT representative_id, representative, district, state, party
-            FROM rep_df
-        """)
+        # Representatives only need rebuilding when transactions changed
+        if changes['new'] or changes['amended'] or changes['removed']:
+            print("Importing representatives...")
+            con_rep = duckdb.connect('databases/representatives.duckdb')
+            refresh_representatives(con_trans, con_rep)
+            con_rep.close()
         
+        set_state(con_trans, 'transactions_source_hash', fingerprint)
         con_trans.close()
-        con_rep.close()
+        if changes['new'] or changes['amended'] or changes['removed']:
+            bump_data_version()
         print("Data import complete")
         return True
         
@@ -256,4 +724,8 @@ def get_trade_profitability(self, representative_name=None):
         return pd.DataFrame()
 
 if __name__ == "__main__":
-    setup_database_schema() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Set up the databases and import the feed")
+    parser.add_argument("--loader", choices=sorted(LOADERS), default='pandas',
+                        help="pandas: normalize in pandas; duckdb: read and clean the raw feed in DuckDB")
+    args = parser.parse_args()
+    setup_database_schema(loader=args.loader) 
\ No newline at end of file
@@ -0,0 +1,136 @@
+import re
+import duckdb
+import argparse
+from datetime import datetime, timedelta
+from run_journal import JOURNAL_DATABASES
+
+# Exchange symbols with an optional share class, e.g. AAPL, BRK.B, BRK/B, BF-B
+SYMBOL_PATTERN = re.compile(r'^[A-Z][A-Z0-9]{0,5}([./-][A-Z0-9]{1,2})?$')
+
+# Placeholders that filings use where no ticker exists
+PLACEHOLDER_SYMBOLS = {'N/A', 'NONE'}
+
+STATUSES = ['active', 'delisted', 'no-data', 'invalid']
+
+def is_valid_symbol(ticker):
+    """Whether a filed ticker looks like a tradable symbol rather than a placeholder or typo"""
+    return bool(ticker) and ticker not in PLACEHOLDER_SYMBOLS and bool(SYMBOL_PATTERN.match(ticker))
+
+def classify_error(error):
+    """Registry status for a failed lookup, or None if the failure looks transient"""
+    text = str(error).lower()
+    if 'delisted' in text or '404' in text or 'not found' in text:
+        return 'delisted'
+    if isinstance(error, KeyError) or 'no data' in text:
+        return 'no-data'
+    return None
+
+class TickerRegistry:
+    """Persistent per-ticker status so known-dead symbols are not requested every run.
+
+    Tickers that came back delisted or without data are retried after an
+    exponentially growing delay (base_days, doubling per failure, up to
+    max_days). Invalid symbols are never requested.
+    """
+
+    def __init__(self, con, job, base_days=1, max_days=90):
+        self.con = con
+        self.job = job
+        self.base_days = base_days
+        self.max_days = max_days
+        self._ensure_table()
+
+    def _ensure_table(self):
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS ticker_registry (
+                job VARCHAR,
+                ticker VARCHAR,
+                status VARCHAR,
+                last_attempt TIMESTAMP,
+                failure_count INTEGER,
+                next_retry_at TIMESTAMP,
+                last_error VARCHAR,
+                PRIMARY KEY (job, ticker)
+            )
+        """)
+
+    def eligible(self, tickers):
+        """Split tickers into those worth requesting now and those skipped, by status"""
+        invalid = [ticker for ticker in tickers if not is_valid_symbol(ticker)]
+        for ticker in invalid:
+            self.record_failure(ticker, 'invalid', "Not a valid ticker symbol", attempted=False)
+
+        waiting = dict(self.con.execute("""
+            SELECT ticker, status FROM ticker_registry
+            WHERE job = ? AND status != 'active' AND next_retry_at > ?
+        """, [self.job, datetime.now()]).fetchall())
+
+        skipped = {}
+        eligible = []
+        invalid = set(invalid)
+        for ticker in tickers:
+            if ticker in invalid:
+                skipped[ticker] = 'invalid'
+            elif ticker in waiting:
+                skipped[ticker] = waiting[ticker]
+            else:
+                eligible.append(ticker)
+        return eligible, skipped
+
+    def record_success(self, ticker):
+        """Mark a ticker active and clear its failure history"""
+        self.con.execute("""
+            INSERT OR REPLACE INTO ticker_registry VALUES (?, ?, 'active', ?, 0, NULL, NULL)
+        """, [self.job, ticker, datetime.now()])
+
+    def record_failure(self, ticker, status, error, attempted=True):
+        """Record a dead-symbol answer and schedule the next retry with exponential backoff"""
+        row = self.con.execute("""
+            SELECT failure_count, last_attempt FROM ticker_registry WHERE job = ? AND ticker = ?
+        """, [self.job, ticker]).fetchone()
+        failures = (row[0] if row else 0) + (1 if attempted else 0)
+        last_attempt = datetime.now() if attempted or not row else row[1]
+        if status == 'invalid':
+            next_retry = datetime.max
+        else:
+            delay = min(self.max_days, self.base_days * 2 ** max(failures - 1, 0))
+            next_retry = datetime.now() + timedelta(days=delay)
+        self.con.execute("""
+            INSERT OR REPLACE INTO ticker_registry VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [self.job, ticker, status, last_attempt, failures, next_retry, str(error)])
+
+def print_registry_summary(job, database=None, max_rows=20):
+    """Print status counts and the tickers currently being skipped for a job"""
+    try:
+        con = duckdb.connect(database or JOURNAL_DATABASES[job], read_only=True)
+        counts = con.execute("""
+            SELECT status, COUNT(*) FROM ticker_registry
+            WHERE job = ?
+            GROUP BY status
+        """, [job]).fetchall()
+    except (duckdb.Error, OSError) as e:
+        print(f"{job}: no ticker registry ({e})")
+        if 'con' in locals():
+            con.close()
+        return
+    counts = dict(counts)
+    print(f"{job}: " + ", ".join(f"{status}: {counts.get(status, 0)}" for status in STATUSES))
+
+    skipped = con.execute("""
+        SELECT ticker, status, failure_count, next_retry_at, last_error FROM ticker_registry
+        WHERE job = ? AND status != 'active'
+        ORDER BY next_retry_at, ticker
+        LIMIT ?
+    """, [job, max_rows]).fetchdf()
+    con.close()
+    if not skipped.empty:
+        print(skipped.to_string(index=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the ticker registry of the fetch jobs")
+    parser.add_argument("command", choices=['status'])
+    parser.add_argument("--job", choices=sorted(JOURNAL_DATABASES), default=None,
+                        help="Only show this job (default: all)")
+    args = parser.parse_args()
+    for job in ([args.job] if args.job else sorted(JOURNAL_DATABASES)):
+        print_registry_summary(job)
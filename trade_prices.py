@@ -0,0 +1,118 @@
+import time
+import duckdb
+import argparse
+import pandas as pd
+from pipeline_state import bump_data_version
+
+TRADE_PRICES_TABLE = 'trade_prices'
+
+# Forward return horizons, in trading days after the as-of trade price
+RETURN_HORIZONS = [1, 5, 30, 90, 180]
+
+# One row per trade with the close on or before the trade date, the close on or
+# before the disclosure date and forward returns. The forward closes come from a
+# single windowed pass over each ticker's sorted prices; joins use the ticker key.
+TRADE_PRICES_QUERY = """
+    WITH trades AS (
+        SELECT
+            row_key,
+            ticker_id,
+            ticker,
+            representative,
+            party,
+            transaction_date,
+            disclosure_date,
+            type,
+            amount
+        FROM transactions
+        WHERE ticker IS NOT NULL AND ticker != ''
+        AND transaction_date IS NOT NULL
+        {ticker_filter}
+    ),
+    forward_prices AS (
+        SELECT
+            ticker_id,
+            date,
+            close,
+            {forward_closes}
+        FROM prices.daily_prices
+        WHERE TRUE {ticker_filter}
+        WINDOW ticker_days AS (PARTITION BY ticker_id ORDER BY date)
+    )
+    SELECT
+        t.* EXCLUDE (ticker_id),
+        p.date as price_date,
+        p.close as price_at_trade,
+        d.close as price_at_disclosure,
+        {forward_returns}
+    FROM trades t
+    ASOF LEFT JOIN forward_prices p
+        ON t.ticker_id = p.ticker_id AND t.transaction_date >= p.date
+    ASOF LEFT JOIN prices.daily_prices d
+        ON t.ticker_id = d.ticker_id AND t.disclosure_date >= d.date
+"""
+
+def trade_prices_query(tickers=None):
+    """The trade price query, optionally restricted to the tickers in trade_price_tickers"""
+    ticker_filter = ""
+    if tickers is not None:
+        ticker_filter = "AND ticker IN (SELECT ticker FROM trade_price_tickers)"
+    forward_closes = ",\n            ".join(
+        f"LEAD(close, {days}) OVER ticker_days as close_{days}d" for days in RETURN_HORIZONS
+    )
+    forward_returns = ",\n        ".join(
+        f"p.close_{days}d / p.close - 1 as return_{days}d" for days in RETURN_HORIZONS
+    )
+    return TRADE_PRICES_QUERY.format(ticker_filter=ticker_filter, forward_closes=forward_closes,
+                                     forward_returns=forward_returns)
+
+def build_trade_prices(con, tickers=None):
+    """Rebuild trade_prices, or only the rows of the given tickers.
+
+    Expects the prices database attached as `prices`. Returns the number of
+    rows written.
+    """
+    if tickers is None:
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {TRADE_PRICES_TABLE} AS
+            SELECT * FROM ({trade_prices_query()})
+            ORDER BY ticker, transaction_date
+        """)
+        con.execute(f"CREATE INDEX idx_{TRADE_PRICES_TABLE}_ticker ON {TRADE_PRICES_TABLE} (ticker)")
+        return con.execute(f"SELECT COUNT(*) FROM {TRADE_PRICES_TABLE}").fetchone()[0]
+
+    con.register('trade_price_tickers', pd.DataFrame({
+        'ticker': pd.Series(list(tickers), dtype=object)
+    }))
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"""
+            DELETE FROM {TRADE_PRICES_TABLE}
+            WHERE ticker IN (SELECT ticker FROM trade_price_tickers)
+        """)
+        rows = con.execute(f"""
+            INSERT INTO {TRADE_PRICES_TABLE}
+            SELECT * FROM ({trade_prices_query(tickers)})
+            ORDER BY ticker, transaction_date
+        """).fetchone()[0]
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.unregister('trade_price_tickers')
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the per-trade price and forward return table")
+    parser.add_argument("--ticker", action="append", default=None,
+                        help="Only rebuild this ticker (repeatable)")
+    args = parser.parse_args()
+
+    con = duckdb.connect('databases/transactions.duckdb')
+    con.execute("ATTACH 'databases/stock_prices.duckdb' AS prices (READ_ONLY)")
+    started = time.perf_counter()
+    rows = build_trade_prices(con, args.ticker)
+    print(f"Wrote {rows} trade prices in {time.perf_counter() - started:.2f}s")
+    con.close()
+    bump_data_version()